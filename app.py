@@ -6,6 +6,7 @@ import os
 import threading
 from datetime import datetime, timedelta
 import json
+from meter_store import get_reading_at
 
 
 # change format of time in meter_data
@@ -55,15 +56,10 @@ def save_data(data):
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 
-# Helper function to find closest timestamp reading
-def get_reading_at(readings, target_time):
-    readings_sorted = sorted(readings, key=lambda x: abs(x["timestamp"] - target_time))
-    return readings_sorted[0]["reading_kwh"] if readings_sorted else None   
-
 def get_reading(reading, timestamp):
     """取得最接近指定時間戳的讀數"""
-    closest_reading = min(reading, key=lambda r: abs(r["timestamp"] - timestamp))
-    return closest_reading["reading_kwh"]
+    # readings are appended as they arrive, the lookup bisects so it needs them in time order
+    return get_reading_at(sorted(reading, key=lambda r: r["timestamp"]), timestamp)
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 lock = threading.Lock()
@@ -323,9 +319,10 @@ def handle_user_query(login_clicks, query_clicks, user_id, query_type):
         if not filtered_readings:
             return ("⚠️ No Data Available", {"display": "block"}, "No electricity data found for this period.", go.Figure())
 
-        # 计算电力使用量
-        results["usage"] = get_reading_at(filtered_readings, max(r["timestamp"] for r in filtered_readings)) - \
-                           get_reading_at(filtered_readings, min(r["timestamp"] for r in filtered_readings))
+        # 计算电力使用量 (write_to_meter_data appends late readings at the end, the lookup needs time order)
+        ordered = sorted(filtered_readings, key=lambda r: r["timestamp"])
+        results["usage"] = get_reading_at(ordered, ordered[-1]["timestamp"]) - \
+                           get_reading_at(ordered, ordered[0]["timestamp"])
 
         # 绘制图表
         timestamps = [r["timestamp"] for r in filtered_readings]
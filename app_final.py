@@ -1,34 +1,41 @@
 # The final version for the project
 import dash
-from dash import html, dcc, Input, Output, State, ctx
-import pandas as pd
-import plotly.graph_objects as go
+from dash import html, dcc, Input, Output, State, ctx, Patch
+from dash.exceptions import PreventUpdate
+from flask import request, jsonify
 import os
 import threading
 from datetime import datetime, timedelta
 import json
 import time
 from collections import defaultdict
+from meter_store import (MeterSeries, StripedLock, to_epoch, from_epoch, parse_timestamp, format_timestamp,
+                         bucket_usage, latest_allowed, meter_id_too_long)
+from snapshot import load_snapshot, write_snapshot, snapshot_is_current
+from meter_json import load_meter_json, write_meter_json, atomic_open
+from wal import WriteAheadLog
+from bulk_ingest import parse_jsonl, parse_csv, ingest_batch, ACCEPTED
+from area_aggregation import cumulative_usage
+from registration_index import RegistrationIndex
+from query_cache import QueryCache
+from figures import EMPTY_FIGURE, USER_LAYOUT, GOV_LAYOUTS, bar_figure
+from ring_buffer import RingBuffer
+from snapshot_scheduler import SnapshotScheduler
+from retention import DAY, TieredStore, RetentionPolicy
+from jobs import JobScheduler, DONE, FAILED, CANCELLED
+from ingest_server import IngestServer
 
 
 # ↓ Some Key Functions ↓
-# change format of time in meter_data(str to datetime)
-def format_meter_data():
-    
-    global meter_data  
-
-    for meter_id in meter_data:
-        for entry in meter_data[meter_id]:
-            if isinstance(entry["timestamp"], str): 
-                entry["timestamp"] = datetime.strptime(entry["timestamp"], "%Y-%m-%dT%H:%M:%S")
-
-
-
-def read_json_files(meter_data_path, registration_path):
-    #read meter_data and Registration when restart
+def read_json_files(meter_data_path, registration_path, snapshot_path=None):
+    #read meter_data and Registration when restart, binary snapshot is used instead of meter_data when it is up to date
     try:
-        with open(meter_data_path, 'r', encoding='utf-8') as file:
-            meter_data = json.load(file)
+        if snapshot_path and snapshot_is_current(snapshot_path, meter_data_path):
+            meter_data = load_snapshot(snapshot_path)
+        else:
+            # streamed one meter at a time, time strings are parsed here once,
+            # every series in meter_data holds epoch seconds from then on
+            meter_data = load_meter_json(meter_data_path, workers=PROCESS_WORKERS)
         
         with open(registration_path, 'r', encoding='utf-8') as file:
             registration_data = json.load(file)
@@ -41,22 +48,76 @@ def read_json_files(meter_data_path, registration_path):
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {e}")
         return None, None
+    except ValueError as e:
+        print(f"Invalid meter data: {e}")
+        return None, None
 
 
 def save_user(data):
-    #Save Registration data to json file 
-    with open(registration_data_location, 'w', encoding='utf-8') as f:
+    #Save Registration data to json file (small and edited by hand, stays indented), replaced in one step
+    with atomic_open(registration_data_location) as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 def save_meter(data):
-    #Save Meter data to json file, but datetime can not store, so change format 1st.
-    for meter_id in data:
-        for entry in data[meter_id]:
-            if isinstance(entry["timestamp"], datetime):
-                entry["timestamp"] = entry["timestamp"].strftime("%Y-%m-%dT%H:%M:%S")
+    #Save Meter data to json file, epoch seconds are written back as time strings
+    def write_files():
+        # tiers first: the raw files written next may already miss readings only the tiers hold now
+        meter_tiers.save(meter_snapshot_location, meter_locks)
+        saved = copy_meter_data(data)
+        write_meter_json(saved, meter_data_location, indent=METER_JSON_INDENT, workers=PROCESS_WORKERS)
 
-    with open(meter_data_location, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        # snapshot after json, so next start can skip the json file
+        write_snapshot(saved, meter_snapshot_location)
+
+    # wal is rotated before the copy is taken, so the older segments are not needed any more
+    meter_wal.checkpoint(write_files)
+
+
+# binary snapshots of raw readings and retention tiers, for the wal compactor
+def write_meter_snapshots():
+    meter_tiers.save(meter_snapshot_location, meter_locks)
+    write_snapshot(copy_meter_data(meter_data), meter_snapshot_location)
+
+
+# copy of meter data, so files can be written while readings keep coming
+# every series is copied under its own lock, so each one is consistent on its own
+def copy_meter_data(data):
+    copies = {}
+    for meter_id, series in list(data.items()):
+        with meter_locks(meter_id):
+            copies[meter_id] = series.copy()
+    return copies
+
+
+# point-in-time view of meter data, its retention tiers and registration data for the snapshot scheduler
+# all meter locks are held only while every series is switched to copy-on-write, nothing is copied here
+def capture_data():
+    with lock:
+        registration = [dict(record) for record in registration_data]
+        with meter_locks.holding_all():
+            views = {meter_id: series.frozen() for meter_id, series in list(meter_data.items())}
+            tier_views = meter_tiers.frozen()
+
+    def release():
+        for meter_id, view in views.items():
+            with meter_locks(meter_id):
+                series = meter_data.get(meter_id)
+                if series is not None:
+                    series.release(view)
+        meter_tiers.release(tier_views, meter_locks)
+
+    files = {"meter_data.snap": views}
+    for name, tier in tier_views.items():
+        files[os.path.basename(TieredStore.tier_path("meter_data.snap", name))] = tier
+    return files, registration, release
+
+
+# replay readings from the write-ahead log that are newer than the snapshot/json
+def replay_meter_wal(wal):
+    for meter_id, timestamp, reading_kwh in wal.replay():
+        if meter_id not in meter_data:
+            meter_data[meter_id] = MeterSeries()
+        meter_data[meter_id].insert(timestamp, reading_kwh)
 
 
 # server shut down(use when at 0:00)
@@ -67,47 +128,83 @@ def shutdown_server():
     
     os._exit(0)
 
-# Find closest timestamp when meter reading
-def get_reading_at(readings, target_time):
-    readings_sorted = sorted(readings, key=lambda x: abs(x["timestamp"] - target_time))
-    return readings_sorted[0]["reading_kwh"] if readings_sorted else None   
-
 # Data Insert Function
 def write_to_meter_data(meter_id, timestamp, reading_kwh):
     global meter_data  # make sure we change globally
 
-    # make sure format can use
-    if isinstance(timestamp, str):
-        timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-
-    # make sure have this meter in the list
-    if meter_id not in meter_data:
-        meter_data[meter_id] = []
-
-    # make sure data in list are in good structure and format
-    for entry in meter_data[meter_id]:
-        if isinstance(entry["timestamp"], str):
-            entry["timestamp"] = datetime.strptime(entry["timestamp"], "%Y-%m-%dT%H:%M:%S")
-
-    # Check 1: Is the timestamp already exist in meter_data?
-    for entry in meter_data[meter_id]:
-        if entry["timestamp"] == timestamp:
-            return "Error: Duplicate timestamp. Data not inserted."
+    # the wal and the snapshot keep a meter id's length in 16 bits
+    if meter_id_too_long(meter_id):
+        return "Error: Meter ID is too long. Data not inserted."
+
+    # make sure format can use (epoch seconds)
+    timestamp = parse_timestamp(timestamp)
+    if timestamp > latest_allowed():
+        return "Error: Timestamp is in the future. Data not inserted."
+
+    # make sure have this meter in the list (setdefault is one step, two new meters cannot clash)
+    series = meter_data.get(meter_id)
+    if series is None:
+        series = meter_data.setdefault(meter_id, MeterSeries())
+
+    # insert it at the exact place, the series refuses a timestamp it already has
+    # only this meter's lock is held, ingests to other meters go on meanwhile
+    with meter_locks(meter_id):
+        if meter_tiers.too_old(meter_id, timestamp):
+            return "Error: Reading is older than the kept raw data. Data not inserted."
+        inserted = series.insert(timestamp, reading_kwh)
+        if inserted:
+            meter_tiers.fold(meter_id, timestamp, reading_kwh)
+    if not inserted:
+        return "Error: Duplicate timestamp. Data not inserted."
+    invalidate_queries(meter_id)
+
+    # on disk before we answer, one fsync is shared by readings arriving together
+    meter_wal.append(meter_id, timestamp, reading_kwh)
+    return "Data inserted successfully!"
 
-    # Check 2: Find the exact insert place
-    index = 0
-    while index < len(meter_data[meter_id]) and meter_data[meter_id][index]["timestamp"] < timestamp:
-        index += 1
+# Bulk Data Insert Function, rows are (meter_id, timestamp, reading_kwh), gives back one status per row
+def write_batch_to_meter_data(rows):
+    statuses, accepted = ingest_batch(meter_data, rows, meter_locks, meter_tiers)
+    for meter_id in {meter_id for meter_id, _, _ in accepted}:
+        invalidate_queries(meter_id)
+    if accepted:
+        meter_wal.append_many(accepted)
+    return statuses
 
-    # insert it
-    meter_data[meter_id].insert(index, {"timestamp": timestamp, "reading_kwh": reading_kwh})
-    return "Data inserted successfully!"
+# cached query results that read this meter (its own and its area's) are stale now
+def invalidate_queries(meter_id):
+    scopes = [("meter", meter_id)]
+    record = registration_index.meter(meter_id)
+    if record is not None:
+        scopes.append(("area", record["region"], record["area"]))
+    query_cache.bump(*scopes)
 
 
 # ↓ Dash App Codes ↓
 # Define dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 lock = threading.Lock()
+meter_locks = StripedLock(64)  # meter_locks(meter_id): held to change a meter's series or read it consistently
+query_cache = QueryCache(max_entries=1024, ttl=300)  # user / government query results
+DISPLAY_ROWS = 50  # readings shown on the meter reading page
+METER_JSON_INDENT = None  # compact meter_data.json, 4 gives the old indented layout
+SNAPSHOT_INTERVAL = 600  # seconds between background snapshots
+SNAPSHOT_RETENTION = 6  # background snapshots kept
+RAW_DAYS = 35  # raw readings kept, older history lives in the hourly / daily / monthly tiers (retention.py);
+              # government queries go back 30 days from any time of day, so they are exact while this is > 31
+              # once retention has run, meter_data.json (and app.py / user_query_Yidi.py reading it) only has
+              # these days; the older history is only in meter_data.{hourly,daily,monthly}.snap, back them up
+HOURLY_DAYS = 180  # hourly tier kept
+DAILY_DAYS = 3 * 365  # daily tier kept, the monthly tier is never cut
+RETENTION_INTERVAL = 3600  # seconds between background retention runs
+JOB_WORKERS = 2  # threads running background jobs (aggregation, long government queries)
+LONG_GOV_QUERIES = ("past_month",)  # government queries run as background jobs when not cached
+PROCESS_WORKERS = None  # processes for per-meter work on load / tier build / save (parallel.py), None: one per core
+INGEST_PORT = 6667  # line-protocol ingestion (ingest_server.py), None to not start it
+INGEST_HOST = "127.0.0.1"  # the port takes writes without any login, only open it wider behind a firewall
+job_scheduler = JobScheduler(JOB_WORKERS)  # background jobs, polled by the pages through their job ids
+DISPLAY_COLUMNS = ("meter_id", "timestamp", "reading_kwh")
+HIDDEN, SHOWN = {'display': 'none'}, {'display': 'inline-block', 'margin': '5px'}  # job cancel buttons
 
 
 
@@ -130,7 +227,13 @@ app.layout = html.Div([
     html.Button("Back", id="btn-back", n_clicks=0, style={'display': 'none'}),
     # change semi-pages
     html.Div(id="page-content", style={'padding': '20px'}),
-    html.Div(id="aggregate-result", style={'color': 'green', 'textAlign': 'center', 'margin': '10px'}),
+    html.Div([
+        html.Div(id="aggregate-result", style={'color': 'green', 'display': 'inline-block'}),
+        html.Button("Cancel", id="aggregate-cancel-btn", n_clicks=0, style=HIDDEN),
+    ], style={'textAlign': 'center', 'margin': '10px'}),
+    # aggregation runs as a background job, the page polls it by its id
+    dcc.Store(id="aggregate-job", data=None),
+    dcc.Interval(id="aggregate-poll", interval=1000, disabled=True),
 
     dcc.Location(id='shutdown-url', refresh=True),
 
@@ -200,7 +303,7 @@ def government_query_page():
         html.Label("Select Region:"),
         dcc.Dropdown(
             id="region-dropdown",
-            options=[{"label": reg, "value": reg} for reg in sorted(set(u["region"] for u in registration_data))],
+            options=[{"label": reg, "value": reg} for reg in registration_index.regions()],
             placeholder="Select Region"
         ),
 
@@ -221,43 +324,17 @@ def government_query_page():
         ),
 
         html.Button("Query", id="query-btn", n_clicks=0),
+        html.Button("Cancel", id="gov-cancel-btn", n_clicks=0, style=HIDDEN),
         html.Div(id="gov-query-result"),
         dcc.Graph(id="gov-usage-graph"),
+        # long queries run as background jobs, polled by their id
+        dcc.Store(id="gov-job", data=None),
+        dcc.Interval(id="gov-job-poll", interval=1000, disabled=True),
 
         html.Button("Back", id="btn-back", n_clicks=0, style={'margin-top': '10px'})
     ])
 
 
-def write_to_meter_data(meter_id, timestamp, reading_kwh):
-    global meter_data  # make sure we change globally
-
-    # make sure format can use
-    if isinstance(timestamp, str):
-        timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-
-    # make sure have this meter in the list
-    if meter_id not in meter_data:
-        meter_data[meter_id] = []
-
-    # make sure data in list are in good structure and format
-    for entry in meter_data[meter_id]:
-        if isinstance(entry["timestamp"], str):
-            entry["timestamp"] = datetime.strptime(entry["timestamp"], "%Y-%m-%dT%H:%M:%S")
-
-    # Check 1: Is the timestamp already exist in meter_data?
-    for entry in meter_data[meter_id]:
-        if entry["timestamp"] == timestamp:
-            return "Error: Duplicate timestamp. Data not inserted."
-
-    # Check 2: Find the exact insert place
-    index = 0
-    while index < len(meter_data[meter_id]) and meter_data[meter_id][index]["timestamp"] < timestamp:
-        index += 1
-
-    # insert it
-    meter_data[meter_id].insert(index, {"timestamp": timestamp, "reading_kwh": reading_kwh})
-    return "Data inserted successfully!"
-
 # Meter reading page
 def meter_reading_page():
     return html.Div([
@@ -274,7 +351,8 @@ def meter_reading_page():
         # message respond
         html.Div(id='message'),
 
-        # data refresh automatically
+        # data refresh automatically, each tick only asks for readings after this page's cursor
+        dcc.Store(id='data-cursor', data=None),
         dcc.Interval(id='interval-component', interval=2000, n_intervals=0),
 
         # display
@@ -293,38 +371,29 @@ def shutdown_page():
         ]
     )#dash cannot use /n or Enter to change lines, so after asking chatgpt, we use "\xa0"
 
-# data cleaning on a monthly basis
-def aggregate_meter_data():
-    global meter_data
-    
-    aggregated_data = {}
-
-    for meter_id, readings in meter_data.items():
-        monthly_totals = {}
-
-        for entry in readings:
-            timestamp = entry["timestamp"]
-            if isinstance(timestamp, str):
-                timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-
-            month_key = timestamp.strftime("%Y-%m")  # e.g., "2024-02"
-            
-            # sum kWh
-            if month_key not in monthly_totals:
-                monthly_totals[month_key] = 0
-            monthly_totals[month_key] += entry["reading_kwh"]
-
-        aggregated_data[meter_id] = [
-            {"timestamp": f"{month_key}-01T00:00:00", "reading_kwh": total}
-            for month_key, total in monthly_totals.items()
-        ]
-
-    # cover the original data
-    meter_data = aggregated_data
-
-    # save the aggregated ones
+# data cleaning: raw readings past the retention window leave meter_data, the tiers already hold their
+# hourly / daily / monthly history; nothing inside the window is touched
+def apply_retention(job=None):
+    meters = 0
+    items = list(meter_data.items())
+    for number, (meter_id, series) in enumerate(items):
+        if job is not None:
+            job.check()
+            job.report(number, len(items), "Applying retention")
+        with meter_locks(meter_id):
+            dropped = meter_tiers.apply(meter_id, series)
+        if dropped:
+            invalidate_queries(meter_id)
+            meters += 1
+    return meters
+
+def aggregate_meter_data(job=None):
+    meters = apply_retention(job)
+    if job is not None:
+        job.report(1, 1, "Saving meter data")
     save_meter(meter_data)
-    return "Aggregation completed! Monthly data saved."
+    return (f"Retention applied to {meters} meter(s)! Raw readings kept for {RAW_DAYS} days, "
+            f"older data in hourly / daily / monthly tiers.")
 
 # ↓ Callback Functions ↓
 #rules for registration
@@ -342,30 +411,73 @@ def bind_meter(n_clicks, meter_id, user_id):
         return "Error: meterID and userID are required."
 
     with lock:
-        data = registration_data
-
-        for record in data:
-            if record["meterID"] == meter_id:
-                if record["userID"] == "NA":
-                    for rec in data:
-                        if rec["userID"] == user_id and rec["meterID"] != meter_id:
-                            return "Error: userID already exists, choose another."
-
-                    record["userID"] = user_id
-                    #record["timestamp"] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                    save_user(data)
-                    return "Binding Successful!"
-                else:
-                    for rec in data:
-                        if rec["userID"] == user_id and rec["meterID"] != meter_id:
-                            return "Error: userID already exists, choose another."
-
-                    record["userID"] = user_id
-                    #record["timestamp"] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                    save_user(data)
-                    return "Update Successful!"
-
-        return "Error: meterID not found."
+        # index updates the record in registration_data and its own maps together
+        result = registration_index.bind(meter_id, user_id)
+        if "Error" not in result:
+            save_user(registration_data)
+        return result
+
+# (start, end, include_end) in epoch seconds of a user query, relative to the meter's latest reading
+def user_time_window(now, query_type):
+    if query_type == "last_30_min":
+        start_time = now - timedelta(minutes=30)
+    elif query_type == "today":
+        start_time = now.replace(hour=0, minute=0, second=0)
+    elif query_type == "yesterday":
+        start_time = now - timedelta(days=1)
+        end_time = start_time + timedelta(hours=24)
+    elif query_type == "past_week":
+        start_time = now - timedelta(days=7)
+    elif query_type == "past_month":
+        start_time = now - timedelta(days=30)
+
+    if query_type == "yesterday":
+        return (to_epoch(start_time), to_epoch(end_time), False)
+    return (to_epoch(start_time), None, True)
+
+# the query result of one meter, handle_user_query caches it per (meter, query_type, data version)
+def user_query_result(meter_id, query_type):
+    if meter_id not in meter_data:
+        return ("No electricity data found.", {"display": "block"}, "No data for this meter.", EMPTY_FIGURE)
+
+    series = meter_data[meter_id]
+    # latest reading and the window are read together, the copies are worked on after the lock is released
+    with meter_locks(meter_id):
+        if len(series) < 2:
+            return ("No Sufficient Data Available", {"display": "block"}, "Not enough data to calculate consumption.", EMPTY_FIGURE)
+
+        window = user_time_window(from_epoch(series.latest()[0]), query_type)
+        if query_type in ["past_week", "past_month"]:
+            # only daily buckets are asked for: the daily tier holds the first and the last reading of every
+            # day, so whole days come from it exactly, the day the window starts in from the raw readings
+            epochs, readings = meter_tiers.view(meter_id, series, window[0], DAY).slice(*window)
+        else:
+            epochs, readings = series.slice(*window)
+
+    if len(epochs) < 2:
+        return ("No Data Available", {"display": "block"}, "Not enough data points for calculation.", EMPTY_FIGURE)
+
+    # registers are cumulative, so the register column already is the prefix sum of consumption:
+    # the total is last minus first reading of the window, found by the two bisects of slice()
+    total_usage = readings[-1] - readings[0]
+
+    if query_type in ["past_week", "past_month"]:
+        daily_usage = bucket_usage(epochs, readings, 86400)
+        time_labels = [from_epoch(day).strftime("%Y-%m-%d") for day, _ in daily_usage]
+        consumption_values = [usage for _, usage in daily_usage]
+    else:
+        timestamps = [from_epoch(ts) for ts in epochs]
+        consumption_deltas = [readings[i] - readings[i - 1] for i in range(1, len(readings))]
+        time_labels = [
+            f"{timestamps[i - 1].strftime('%m%d %H:%M')} → {timestamps[i].strftime('%H:%M')}"
+            for i in range(1, len(timestamps))
+        ]
+        consumption_values = consumption_deltas
+
+    # plain figure dict on the pre-built layout, no plotly objects on the query path
+    fig = bar_figure(USER_LAYOUT, time_labels, consumption_values, "Electricity Consumption", "royalblue")
+
+    return (f"⚡ Total electricity usage: {total_usage:.2f} kWh", {"display": "block"}, "", fig)
 
 #rules for user query
 @app.callback(
@@ -381,91 +493,23 @@ def handle_user_query(login_clicks, query_clicks, user_id, query_type):
     triggered_id = ctx.triggered_id  
 
     if triggered_id == "login-btn":
-        user = next((u for u in registration_data if u["userID"] == user_id), None)
+        user = registration_index.user(user_id)
         if user:
-            return (f"Login successful! Meter ID: {user['meterID']}", {"display": "block"}, "", go.Figure())
+            return (f"Login successful! Meter ID: {user['meterID']}", {"display": "block"}, "", EMPTY_FIGURE)
         else:
-            return ("User not found. Please enter a valid User ID.", {"display": "none"}, "", go.Figure())
+            return ("User not found. Please enter a valid User ID.", {"display": "none"}, "", EMPTY_FIGURE)
 
     elif triggered_id == "query-btn":
-        format_meter_data()
-        user = next((u for u in registration_data if u["userID"] == user_id), None)
+        user = registration_index.user(user_id)
 
         if not user:
-            return ("User not found.", {"display": "none"}, "No user data available.", go.Figure())
+            return ("User not found.", {"display": "none"}, "No user data available.", EMPTY_FIGURE)
 
         meter_id = user["meterID"]
-        if meter_id not in meter_data:
-            return ("No electricity data found.", {"display": "block"}, "No data for this meter.", go.Figure())
-
-        readings = meter_data[meter_id]
-        if len(readings) < 2:
-            return ("No Sufficient Data Available", {"display": "block"}, "Not enough data to calculate consumption.", go.Figure())
-
-        latest_timestamp = max(r["timestamp"] for r in readings) 
-        now = latest_timestamp
-
-        if query_type == "last_30_min":
-            start_time = now - timedelta(minutes=30)
-        elif query_type == "today":
-            start_time = now.replace(hour=0, minute=0, second=0)
-        elif query_type == "yesterday":
-            start_time = now - timedelta(days=1)
-            end_time = start_time + timedelta(hours=24)
-        elif query_type == "past_week":
-            start_time = now - timedelta(days=7)
-        elif query_type == "past_month":
-            start_time = now - timedelta(days=30)
-
-        filtered_readings = [r for r in readings if r["timestamp"] >= start_time]
-        if query_type == "yesterday":
-            filtered_readings = [r for r in readings if start_time <= r["timestamp"] < end_time]
-
-        if len(filtered_readings) < 2:
-            return ("No Data Available", {"display": "block"}, "Not enough data points for calculation.", go.Figure())
-
-        timestamps = [r["timestamp"] for r in filtered_readings]
-        consumption_deltas = [
-            filtered_readings[i]["reading_kwh"] - filtered_readings[i - 1]["reading_kwh"]
-            for i in range(1, len(filtered_readings))
-        ]
-
-        if query_type in ["past_week", "past_month"]:
-            daily_usage = {}
-            for i in range(1, len(timestamps)):
-                day = timestamps[i - 1].strftime("%Y-%m-%d") 
-                daily_usage[day] = daily_usage.get(day, 0) + consumption_deltas[i - 1]
+        return query_cache.get_or_compute(("meter", meter_id), query_type,
+                                          lambda: user_query_result(meter_id, query_type))
 
-            time_labels = list(daily_usage.keys())
-            consumption_values = list(daily_usage.values())
-        else:
-            time_labels = [
-                f"{timestamps[i - 1].strftime('%m%d %H:%M')} → {timestamps[i].strftime('%H:%M')}"
-                for i in range(1, len(timestamps))
-            ]
-            consumption_values = consumption_deltas
-
-        fig = go.Figure()
-
-        fig.add_trace(go.Bar(
-            x=time_labels, 
-            y=consumption_values, 
-            name="Electricity Consumption",
-            marker_color="royalblue"
-        ))
-
-        fig.update_layout(
-            title="Electricity Consumption",
-            xaxis_title="Time Period",
-            yaxis_title="Consumption (kWh)",
-            xaxis=dict(showgrid=True, tickangle=45),
-            yaxis=dict(showgrid=True),
-            template="plotly_white"
-        )
-
-        return (f"⚡ Total electricity usage: {sum(consumption_values):.2f} kWh", {"display": "block"}, "", fig)
-
-    return ("", {"display": "none"}, "", go.Figure())
+    return ("", {"display": "none"}, "", EMPTY_FIGURE)
 
 #rules for government query_1
 @app.callback(
@@ -474,14 +518,16 @@ def handle_user_query(login_clicks, query_clicks, user_id, query_type):
 )
 def update_area_options(selected_region):
     if selected_region:
-        areas = sorted(set(u["area"] for u in registration_data if u["region"] == selected_region))
+        areas = registration_index.areas_in(selected_region)
         return [{"label": area, "value": area} for area in areas]
     return []
 #rules for government query_2
-def get_time_window(readings, query_type):
-    if not readings:
+def get_time_window(series, query_type):
+    if not len(series):
         return None, None
-    latest_timestamp = max(r["timestamp"] for r in readings)
+    return time_window(from_epoch(series.latest()[0]), query_type)
+
+def time_window(latest_timestamp, query_type):
     if query_type == "last_30_min":
         start_time = latest_timestamp - timedelta(minutes=30)
         end_time = latest_timestamp
@@ -505,40 +551,95 @@ def floor_to_half_hour(dt):
     minute = (dt.minute // 30) * 30
     return dt.replace(minute=minute, second=0, microsecond=0)
 @app.callback(
-    [Output("gov-query-result", "children"), Output("gov-usage-graph", "figure")],
-    Input("query-btn", "n_clicks"),
-    [State("region-dropdown", "value"), State("area-dropdown", "value"), State("query-type", "value")]
+    [Output("gov-query-result", "children"), Output("gov-usage-graph", "figure"),
+     Output("gov-job", "data"), Output("gov-job-poll", "disabled"), Output("gov-cancel-btn", "style")],
+    [Input("query-btn", "n_clicks"), Input("gov-job-poll", "n_intervals"), Input("gov-cancel-btn", "n_clicks")],
+    [State("region-dropdown", "value"), State("area-dropdown", "value"), State("query-type", "value"),
+     State("gov-job", "data")]
 )
-def query_data(n_clicks, region, area, query_type):
-    if not (region and area and query_type):
-        return "Please select region, area, and time period.", go.Figure()
+def handle_gov_query(n_clicks, n_intervals, cancel_clicks, region, area, query_type, job_id):
+    triggered_id = ctx.triggered_id
+
+    if triggered_id in ("gov-job-poll", "gov-cancel-btn"):
+        if triggered_id == "gov-cancel-btn":
+            job_scheduler.cancel(job_id)
+        job = job_scheduler.get(job_id)
+        if job is not None and job.state == DONE:
+            return (*job.result, None, True, HIDDEN)
+        if job is None or job.state in (FAILED, CANCELLED):
+            return job_progress(job), EMPTY_FIGURE, None, True, HIDDEN
+        return job_progress(job), dash.no_update, job_id, False, SHOWN
 
-    meters = [u["meterID"] for u in registration_data if u["region"] == region and u["area"] == area]
+    if not (region and area and query_type):
+        return "Please select region, area, and time period.", EMPTY_FIGURE, None, True, HIDDEN
+
+    if query_type in LONG_GOV_QUERIES:
+        cached = query_cache.get(("area", region, area), query_type)
+        if cached is not None:
+            return (*cached, None, True, HIDDEN)
+        # not cached: computed in the background, the page polls for it
+        job = job_scheduler.submit(f"Government query {region} / {area} ({query_type})", gov_query_job,
+                                   region, area, query_type, key=("gov", region, area, query_type))
+        return job_progress(job), EMPTY_FIGURE, job.id, False, SHOWN
+
+    return (*query_data(region, area, query_type), None, True, HIDDEN)
+
+# (result text, figure) of a government query, cached per (area, query_type, data version)
+def query_data(region, area, query_type, job=None):
+    return query_cache.get_or_compute(("area", region, area), query_type,
+                                      lambda: area_query_result(region, area, query_type, job))
+
+def gov_query_job(job, region, area, query_type):
+    return query_data(region, area, query_type, job)
+
+# what a page shows about a background job
+def job_progress(job):
+    if job is None:
+        return "Job not found (the server may have restarted), please try again."
+    if job.state == FAILED:
+        return f"Job {job.id} failed: {job.error}"
+    if job.state == CANCELLED:
+        return f"Job {job.id} cancelled."
+    return f"{job.message or job.name}: {job.progress:.0%} (job {job.id}, {job.state})"
+
+# the query result of one area, query_data caches it per (area, query_type, data version)
+def area_query_result(region, area, query_type, job=None):
+    meters = registration_index.meters_in(region, area)
     if not meters:
-        return "No registration data found for the selected region and area.", go.Figure()
+        return "No registration data found for the selected region and area.", EMPTY_FIGURE
 
+    # every meter on its own window from its own latest reading, counted from its first reading in it
     meter_data_usage = {}
     overall_start = None
     overall_end = None
-    for meter_id in meters:
+    for number, meter_id in enumerate(meters):
+        if job is not None:
+            job.check()
+            job.report(number, len(meters), "Reading meters")
         if meter_id not in meter_data:
             continue
-        readings = meter_data[meter_id]
-        start_time, end_time = get_time_window(readings, query_type)
-        if start_time is None:
-            continue
-        filtered = [r for r in readings if start_time <= r["timestamp"] <= end_time]
-        if not filtered:
+        series = meter_data[meter_id]
+        with meter_locks(meter_id):
+            start_time, end_time = get_time_window(series, query_type)
+            if start_time is None:
+                continue
+            if query_type in ["past_week", "past_month"]:
+                # day ends only: the last reading of each day is in the daily tier (see user_query_result)
+                view = meter_tiers.view(meter_id, series, to_epoch(start_time), DAY)
+            else:
+                view = series
+            epochs, readings = view.slice(to_epoch(start_time), to_epoch(end_time))
+        if not epochs:
             continue
-        filtered.sort(key=lambda r: r["timestamp"])
-        meter_data_usage[meter_id] = filtered
+        meter_data_usage[meter_id] = (epochs, readings)
         if overall_start is None or start_time < overall_start:
             overall_start = start_time
         if overall_end is None or end_time > overall_end:
             overall_end = end_time
 
     if not meter_data_usage:
-        return " No electricity data found for the selected criteria.", go.Figure()
+        return " No electricity data found for the selected criteria.", EMPTY_FIGURE
+    meter_count = len(meter_data_usage)
 
     # Determine the resolution/bucketing based on query_type
     if query_type in ["today", "yesterday"]:
@@ -572,32 +673,14 @@ def query_data(n_clicks, region, area, query_type):
             buckets.append(current)
             current += resolution
 
-    # Build cumulative usage per meter
-    meter_cumulative = {}
-    for meter_id, readings in meter_data_usage.items():
-        baseline = readings[0]["reading_kwh"]
-        time_series = {}
-        j = 0
-        last_value = baseline
-        for bucket in buckets:
-            if query_type in ["past_week", "past_month"]:
-                while j < len(readings) and readings[j]["timestamp"].date() <= bucket:
-                    last_value = readings[j]["reading_kwh"]
-                    j += 1
-            else:
-                while j < len(readings) and readings[j]["timestamp"] <= bucket:
-                    last_value = readings[j]["reading_kwh"]
-                    j += 1
-            time_series[bucket] = last_value - baseline
-        meter_cumulative[meter_id] = time_series
-
-    # Sum the usage across all meters
-    aggregated_cumulative = {}
-    for bucket in buckets:
-        total = 0
-        for meter_id in meter_cumulative:
-            total += meter_cumulative[meter_id].get(bucket, 0)
-        aggregated_cumulative[bucket] = total
+    # Last epoch second that still belongs to each bucket
+    if query_type in ["past_week", "past_month"]:
+        bucket_limits = [to_epoch(datetime.combine(bucket, datetime.min.time())) + 86399 for bucket in buckets]
+    else:
+        bucket_limits = [to_epoch(bucket) for bucket in buckets]
+
+    # Cumulative usage per meter on the bucket grid, summed across all meters (numpy)
+    aggregated_cumulative = cumulative_usage(list(meter_data_usage.values()), bucket_limits).tolist()
 
     # Prepare x_values and y_values
     if query_type in ["past_week", "past_month"]:
@@ -605,7 +688,7 @@ def query_data(n_clicks, region, area, query_type):
     else:
         x_values = [bucket.strftime("%Y-%m-%d %H:%M") for bucket in buckets]
 
-    y_values = [aggregated_cumulative[bucket] for bucket in buckets]
+    y_values = aggregated_cumulative
 
     # For "last_30_min", we want a single bar representing the total usage over that 30 min window
     if query_type == "last_30_min":
@@ -617,16 +700,10 @@ def query_data(n_clicks, region, area, query_type):
         total_usage = y_values[-1] if y_values else 0
 
     # Create the bar chart
-    fig = go.Figure()
-    fig.add_trace(go.Bar(x=x_values, y=y_values, name="Electricity Usage"))
-    fig.update_layout(
-        title="Electricity Consumption Over Selected Period",
-        xaxis_title="Time" if query_type not in ["past_week", "past_month"] else "Date",
-        yaxis_title="Cumulative Usage (kWh)",
-        template="plotly_white"
-    )
-
-    result_text = f"Electricity usage: {total_usage} kWh (aggregated from {len(meter_cumulative)} meter(s))"
+    layout = GOV_LAYOUTS["Time" if query_type not in ["past_week", "past_month"] else "Date"]
+    fig = bar_figure(layout, x_values, y_values, "Electricity Usage")
+
+    result_text = f"Electricity usage: {total_usage} kWh (aggregated from {meter_count} meter(s))"
     return result_text, fig
 
 # rules for meter reading_1(this one is for data transfer API, meter_data)
@@ -640,14 +717,14 @@ def query_data(n_clicks, region, area, query_type):
 def submit_reading(n_clicks, meter_id, timestamp, reading_kwh):
     if n_clicks > 0 and meter_id and timestamp and reading_kwh is not None:
         try:
-            timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+            timestamp = parse_timestamp(timestamp)
         except ValueError:
             return "Invalid Timestamp Format Use YYYY-MM-DDTHH:MM:SS"
         
         result = write_to_meter_data(meter_id, timestamp, reading_kwh)
 
         if "Error" not in result:
-            data_store.append({"meter_id": meter_id, "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S"),
+            data_store.append({"meter_id": meter_id, "timestamp": format_timestamp(timestamp),
                                "reading_kwh": reading_kwh})
 
         return result 
@@ -655,24 +732,100 @@ def submit_reading(n_clicks, meter_id, timestamp, reading_kwh):
     return "Please fill all fields"
 
 
+# bulk data transfer API for head-end systems, body is JSON Lines or CSV (Content-Type: text/csv)
+@app.server.route("/api/readings/bulk", methods=["POST"])
+def bulk_readings():
+    text = request.get_data(as_text=True)
+    if "csv" in (request.content_type or ""):
+        rows = parse_csv(text)
+    else:
+        rows = parse_jsonl(text)
+
+    statuses = write_batch_to_meter_data(rows)
+    accepted = statuses.count(ACCEPTED)
+    return jsonify({"accepted": accepted, "rejected": len(statuses) - accepted, "results": statuses})
+
+
+# background jobs: list, status (polled), result once done, cancel
+@app.server.route("/api/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify([job.status() for job in job_scheduler.jobs()])
+
+
+@app.server.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": "no such job"}), 404
+    return jsonify(job.status())
+
+
+@app.server.route("/api/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": "no such job"}), 404
+    if job.state != DONE:
+        return jsonify({"error": f"job is {job.state}", "status": job.status()}), 409
+    return jsonify({"id": job.id, "result": job.result})
+
+
+@app.server.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    return jsonify({"cancelled": job_scheduler.cancel(job_id)})
+
+
+# counters of the line-protocol ingestion server
+@app.server.route("/api/ingest/stats", methods=["GET"])
+def ingest_stats():
+    return jsonify(ingest_server.stats() if ingest_server is not None else {})
+
+
+# hit / miss / eviction counters of the query cache
+@app.server.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(query_cache.stats())
+
+
 # rules for meter reading_2(this one is for data display)
 @app.callback(
-    Output('data-display', 'children'),
-    Input('interval-component', 'n_intervals')
+    [Output('data-display', 'children'), Output('data-cursor', 'data')],
+    Input('interval-component', 'n_intervals'),
+    State('data-cursor', 'data')
 )
-def update_data(n):
-    if not data_store:
-        return "No data available"
-
-    # create DataFrame
-    df = pd.DataFrame(data_store)
-
-    # generate a table for uploaded data(data_store)
-    return html.Table([
-        html.Tr([html.Th(col) for col in df.columns])
-    ] + [
-        html.Tr([html.Td(df.iloc[i][col]) for col in df.columns]) for i in range(len(df))
-    ])
+def update_data(n, cursor):
+    # the cursor is the sequence number of the last reading this page shows
+    rows, version = data_store.since(cursor or 0, DISPLAY_ROWS)
+    if cursor == version:
+        raise PreventUpdate
+    if cursor and cursor > version:
+        # cursor from before a server restart
+        cursor = None
+        rows, version = data_store.since(0, DISPLAY_ROWS)
+
+    # new page or far behind: draw the latest window again
+    if not cursor or version - cursor >= DISPLAY_ROWS:
+        if not version:
+            return "No data available", version
+        # generate a table for the latest uploaded data(data_store)
+        return [readings_caption(version), html.Table(
+            [html.Tr([html.Th(col) for col in DISPLAY_COLUMNS])] + [reading_row(row) for row in rows]
+        )], version
+
+    # send only the new rows, the oldest ones drop off the top of the table (row 0 is the header)
+    display = Patch()
+    display[0] = readings_caption(version)
+    table_rows = display[1]["props"]["children"]
+    for _ in range(max(0, min(cursor, DISPLAY_ROWS) + len(rows) - DISPLAY_ROWS)):
+        del table_rows[1]
+    table_rows.extend([reading_row(row) for row in rows])
+    return display, version
+
+def reading_row(row):
+    return html.Tr([html.Td(row[col]) for col in DISPLAY_COLUMNS])
+
+def readings_caption(version):
+    return f"Latest {min(version, DISPLAY_ROWS)} of {version} readings"
 
 # rule for shut down
 # open new page 1st, then actual shut down
@@ -718,15 +871,29 @@ def update_page(btn_user, btn_query, btn_gov, btn_meter, btn_shutdown):
 
     return html.Div("404 - Page Not Found")
 
-#for data cleaning on monthly basis
+#for data cleaning on monthly basis, runs as a background job and the page polls it
 @app.callback(
-    Output("aggregate-result", "children"),
-    Input("aggregate-btn", "n_clicks"),
+    [Output("aggregate-result", "children"), Output("aggregate-job", "data"),
+     Output("aggregate-poll", "disabled"), Output("aggregate-cancel-btn", "style")],
+    [Input("aggregate-btn", "n_clicks"), Input("aggregate-poll", "n_intervals"),
+     Input("aggregate-cancel-btn", "n_clicks")],
+    State("aggregate-job", "data"),
     prevent_initial_call=True
 )
-def trigger_aggregation(n_clicks):
-    result = aggregate_meter_data()
-    return result
+def trigger_aggregation(n_clicks, n_intervals, cancel_clicks, job_id):
+    if ctx.triggered_id == "aggregate-btn":
+        # a second click while it runs gets the running job back
+        job = job_scheduler.submit("Aggregation", aggregate_meter_data, key="aggregate")
+        return job_progress(job), job.id, False, SHOWN
+
+    if ctx.triggered_id == "aggregate-cancel-btn":
+        job_scheduler.cancel(job_id)
+    job = job_scheduler.get(job_id)
+    if job is not None and job.state == DONE:
+        return job.result, None, True, HIDDEN
+    if job is None or job.state in (FAILED, CANCELLED):
+        return job_progress(job), None, True, HIDDEN
+    return job_progress(job), job_id, False, SHOWN
 
 
 
@@ -737,9 +904,31 @@ def trigger_aggregation(n_clicks):
 if __name__ == '__main__':
     registration_data_location = "Registration.json"
     meter_data_location = "meter_data.json"
-    meter_data, registration_data = read_json_files(meter_data_location, registration_data_location)
-    data_store = []
-    for meter_id in meter_data:
-        for entry in meter_data[meter_id]:
-            entry["timestamp"] = datetime.strptime(entry["timestamp"], "%Y-%m-%dT%H:%M:%S")
-    app.run_server(port=6666, debug=True)
\ No newline at end of file
+    meter_snapshot_location = "meter_data.snap"
+    meter_data, registration_data = read_json_files(meter_data_location, registration_data_location,
+                                                    meter_snapshot_location)
+    data_store = RingBuffer(1000)  # latest submitted readings, for the meter reading page
+    meter_wal = WriteAheadLog("meter_wal")
+    replay_meter_wal(meter_wal)
+    registration_index = RegistrationIndex(registration_data)
+    meter_tiers = TieredStore(RetentionPolicy(RAW_DAYS, HOURLY_DAYS, DAILY_DAYS))
+    meter_tiers.load(meter_snapshot_location)
+    meter_tiers.sync_all(meter_data, PROCESS_WORKERS)
+    for meter_id, series in meter_data.items():
+        meter_tiers.apply(meter_id, series)
+    if not snapshot_is_current(meter_snapshot_location, meter_data_location):
+        meter_tiers.save(meter_snapshot_location, meter_locks)
+        write_snapshot(meter_data, meter_snapshot_location)
+    meter_wal.start_compactor(300, write_meter_snapshots)
+    meter_tiers.start(RETENTION_INTERVAL, apply_retention)
+    # head-end systems stream readings here, batched into the same store, answered once in the wal
+    ingest_server = None
+    if INGEST_PORT is not None:
+        try:
+            ingest_server = IngestServer(write_batch_to_meter_data, host=INGEST_HOST, port=INGEST_PORT).start()
+        except OSError as e:
+            print(f"Ingestion server not started: {e}")
+    snapshot_scheduler = SnapshotScheduler("snapshots", capture_data, SNAPSHOT_INTERVAL, SNAPSHOT_RETENTION).start()
+    # no reloader: it runs this block again in a second process, which would own the wal, the snapshot,
+    # retention and ingestion threads a second time next to this one
+    app.run_server(port=6666, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,904 @@
+# Small benchmarks for the hot paths of app_final.py
+# run: python benchmark.py [name ...]   (no name = run all)
+#      python benchmark.py suite [options]   (generated data at scale, results kept as json, see run_suite)
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from area_aggregation import cumulative_usage
+from bulk_ingest import parse_csv, ingest_batch
+from figures import EMPTY_FIGURE, USER_LAYOUT, bar_figure
+from ingest_server import IngestServer, memory_handler, run_load
+from meter_json import load_meter_json, write_meter_json
+from meter_store import (EPOCH, ONE_SECOND, TIME_FORMAT, MeterSeries, StripedLock, bucket_usage, format_timestamp,
+                         from_epoch, get_reading_at, parse_timestamp, parse_timestamps)
+from parallel import worker_count
+from query_cache import QueryCache
+from registration_index import RegistrationIndex
+from retention import DAY, TieredStore, RetentionPolicy
+from snapshot import load_snapshot, write_snapshot
+from snapshot_scheduler import SnapshotScheduler
+from wal import WriteAheadLog
+
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+
+
+METER_DATA_PATH = "meter_data.json"
+
+
+def load_raw_meter_data(path=METER_DATA_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def measure_memory(build):
+    # bytes still held by whatever build() returns
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+# memory of meter_data.json as list of dicts (the old way) vs MeterSeries columns
+def bench_memory():
+    raw = load_raw_meter_data()
+    total = sum(len(entries) for entries in raw.values())
+
+    def as_dicts():
+        return {meter_id: [{"timestamp": datetime.strptime(e["timestamp"], "%Y-%m-%dT%H:%M:%S"),
+                            "reading_kwh": e["reading_kwh"]} for e in entries]
+                for meter_id, entries in raw.items()}
+
+    def as_series():
+        return {meter_id: MeterSeries.from_entries(entries) for meter_id, entries in raw.items()}
+
+    _, dict_bytes = measure_memory(as_dicts)
+    _, series_bytes = measure_memory(as_series)
+    print(f"memory: {len(raw)} meters, {total} readings")
+    print(f"  list of dicts : {dict_bytes:>10} bytes ({dict_bytes / total:.1f} bytes/reading)")
+    print(f"  MeterSeries   : {series_bytes:>10} bytes ({series_bytes / total:.1f} bytes/reading)")
+    print(f"  saving        : {1 - series_bytes / dict_bytes:.1%}")
+
+
+def timed(function, repeat=5):
+    # best of a few runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+# start up: json.load + timestamp parsing vs opening the binary snapshot
+def bench_startup():
+    def from_json():
+        raw = load_raw_meter_data()
+        return {meter_id: MeterSeries.from_entries(entries) for meter_id, entries in raw.items()}
+
+    meter_data, json_time = timed(from_json)
+    snapshot_path = os.path.join(tempfile.mkdtemp(), "meter_data.snap")
+    write_snapshot(meter_data, snapshot_path)
+
+    _, open_time = timed(lambda: load_snapshot(snapshot_path))
+    first_meter = next(iter(meter_data))
+    _, one_meter_time = timed(lambda: load_snapshot(snapshot_path)[first_meter].latest())
+    _, all_meters_time = timed(lambda: [s.latest() for s in load_snapshot(snapshot_path).values()])
+    print(f"startup: {len(meter_data)} meters")
+    print(f"  json + parse          : {json_time * 1000:8.2f} ms")
+    print(f"  snapshot open         : {open_time * 1000:8.2f} ms")
+    print(f"  snapshot + one meter  : {one_meter_time * 1000:8.2f} ms")
+    print(f"  snapshot + all meters : {all_meters_time * 1000:8.2f} ms")
+
+
+def old_write_to_meter_data(readings, timestamp, reading_kwh):
+    # the list-of-dicts insert app_final.py used before MeterSeries
+    for entry in readings:
+        if entry["timestamp"] == timestamp:
+            return "Error: Duplicate timestamp. Data not inserted."
+    index = 0
+    while index < len(readings) and readings[index]["timestamp"] < timestamp:
+        index += 1
+    readings.insert(index, {"timestamp": timestamp, "reading_kwh": reading_kwh})
+    return "Data inserted successfully!"
+
+
+def half_hourly_series(count, start=1735689600):
+    return MeterSeries(range(start, start + count * 1800, 1800), [float(i) for i in range(count)])
+
+
+# cost of one insert as the history of a meter grows
+def bench_insert():
+    inserts = 1000
+    print(f"insert: microseconds per reading, {inserts} readings into a meter with n readings")
+    print(f"  {'n':>9} {'in order':>10} {'late':>10} {'duplicate':>10} {'old (late)':>11}")
+    for count in (1_000, 10_000, 100_000, 1_000_000):
+        rng = random.Random(count)
+        end = 1735689600 + count * 1800
+        late = [1735689600 + rng.randrange(count) * 1800 + 1 for _ in range(inserts)]
+        duplicate = [1735689600 + rng.randrange(count) * 1800 for _ in range(inserts)]
+
+        def run(timestamps):
+            series = half_hourly_series(count)
+            start = time.perf_counter()
+            for ts in timestamps:
+                series.insert(ts, 1.0)
+            return (time.perf_counter() - start) / len(timestamps) * 1e6
+
+        in_order_us = run(range(end, end + inserts * 1800, 1800))
+        late_us = run(late)
+        duplicate_us = run(duplicate)
+
+        old_us = float("nan")
+        if count <= 10_000:
+            readings = [{"timestamp": ts, "reading_kwh": kwh} for ts, kwh in half_hourly_series(count)]
+            start = time.perf_counter()
+            for ts in late[:100]:
+                old_write_to_meter_data(readings, ts, 1.0)
+            old_us = (time.perf_counter() - start) / 100 * 1e6
+        print(f"  {count:>9} {in_order_us:>10.2f} {late_us:>10.2f} {duplicate_us:>10.2f} {old_us:>11.1f}")
+
+
+# bulk ingestion: parse + validate + sort + merge a CSV batch
+def bench_bulk():
+    meters, per_meter = 1000, 100
+    rng = random.Random(5)
+    lines = [f"{m:03d}-000-000,{format_timestamp(1735689600 + i * 1800)},{i * 0.5}"
+             for i in range(per_meter) for m in range(meters)]
+    rng.shuffle(lines)
+    text = "meter_id,timestamp,reading_kwh\n" + "\n".join(lines)
+
+    start = time.perf_counter()
+    rows = parse_csv(text)
+    parsed = time.perf_counter()
+    meter_data = {f"{m:03d}-000-000": half_hourly_series(1000, start=1735689600 - 1000 * 1800)
+                  for m in range(meters)}
+    merge_start = time.perf_counter()
+    statuses, accepted = ingest_batch(meter_data, rows, StripedLock())
+    end = time.perf_counter()
+    total = len(rows)
+    print(f"bulk: {total} readings for {meters} meters (shuffled, 1000 readings history each)")
+    print(f"  parse csv        : {(parsed - start) * 1000:8.1f} ms")
+    print(f"  validate + merge : {(end - merge_start) * 1000:8.1f} ms")
+    print(f"  throughput       : {total / (parsed - start + end - merge_start):,.0f} readings/s"
+          f" ({len(accepted)} accepted)")
+
+
+def old_get_reading_at(readings, target_time):
+    readings_sorted = sorted(readings, key=lambda x: abs(x["timestamp"] - target_time))
+    return readings_sorted[0]["reading_kwh"] if readings_sorted else None
+
+
+def old_get_reading(reading, timestamp):
+    closest_reading = min(reading, key=lambda r: abs(r["timestamp"] - timestamp))
+    return closest_reading["reading_kwh"]
+
+
+# closest-reading lookup: sort / min over the readings vs binary search (get_reading_at)
+def bench_nearest():
+    print("nearest: microseconds per lookup")
+    print(f"  {'n':>9} {'sort (old)':>11} {'min (old)':>10} {'binary search':>14}")
+    for count in (1886, 100_000):
+        series = half_hourly_series(count)
+        readings = [{"timestamp": ts, "reading_kwh": kwh} for ts, kwh in series]
+        rng = random.Random(count)
+        targets = [rng.randrange(series.timestamps[0], series.timestamps[-1]) for _ in range(200)]
+
+        def per_lookup(function, targets):
+            start = time.perf_counter()
+            for target in targets:
+                function(target)
+            return (time.perf_counter() - start) / len(targets) * 1e6
+
+        sort_us = per_lookup(lambda t: old_get_reading_at(readings, t), targets[:20])
+        min_us = per_lookup(lambda t: old_get_reading(readings, t), targets[:20])
+        dict_us = per_lookup(lambda t: get_reading_at(readings, t), targets)
+        print(f"  {count:>9} {sort_us:>11.1f} {min_us:>10.1f} {dict_us:>14.2f}")
+
+
+def old_cumulative_usage(columns, bucket_limits):
+    # the per-meter, per-bucket loop query_data used before area_aggregation
+    meter_cumulative = []
+    for epochs, readings in columns:
+        baseline = readings[0]
+        time_series = []
+        j = 0
+        last_value = baseline
+        for limit in bucket_limits:
+            while j < len(epochs) and epochs[j] <= limit:
+                last_value = readings[j]
+                j += 1
+            time_series.append(last_value - baseline)
+        meter_cumulative.append(time_series)
+    totals = []
+    for k in range(len(bucket_limits)):
+        total = 0
+        for time_series in meter_cumulative:
+            total += time_series[k]
+        totals.append(total)
+    return totals
+
+
+# government "past_month" query for one area: python loops vs numpy resampling
+def bench_area():
+    print("area: past_month (30 days of half-hourly readings per meter)")
+    print(f"  {'meters':>7} {'buckets':>8} {'old loop':>10} {'numpy':>10}")
+    start = 1735689600
+    for meters in (10, 1000, 5000):
+        columns = [half_hourly_series(1440, start=start + m % 1800).slice() for m in range(meters)]
+        for width in (86400, 3600):
+            limits = list(range(start + width - 1, start + 30 * 86400, width))
+            _, old_time = timed(lambda: old_cumulative_usage(columns, limits), repeat=1)
+            _, new_time = timed(lambda: cumulative_usage(columns, limits), repeat=3)
+            print(f"  {meters:>7} {len(limits):>8} {old_time * 1000:>8.1f}ms {new_time * 1000:>8.1f}ms")
+
+
+def old_user_figure(x, y):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=x, y=y, name="Electricity Consumption", marker_color="royalblue"))
+    fig.update_layout(
+        title="Electricity Consumption",
+        xaxis_title="Time Period",
+        yaxis_title="Consumption (kWh)",
+        xaxis=dict(showgrid=True, tickangle=45),
+        yaxis=dict(showgrid=True),
+        template="plotly_white"
+    )
+    return fig
+
+
+# user query chart: go.Figure built per callback vs dict on the pre-built layout, both serialized the way Dash does
+def bench_figure():
+    print("figure: build + serialize one bar chart")
+    print(f"  {'bars':>6} {'go.Figure':>10} {'dict':>9} {'speedup':>8}")
+    for bars in (1, 30, 720):
+        x = [f"0219 {i // 60:02d}:{i % 60:02d}" for i in range(bars)]
+        y = [random.random() for _ in range(bars)]
+        _, old_time = timed(lambda: to_json_plotly(old_user_figure(x, y)), 20)
+        _, new_time = timed(lambda: to_json_plotly(bar_figure(USER_LAYOUT, x, y, "Electricity Consumption",
+                                                              "royalblue")), 20)
+        print(f"  {bars:>6} {old_time * 1000:>8.2f}ms {new_time * 1000:>7.2f}ms {old_time / new_time:>7.1f}x")
+    _, old_time = timed(lambda: to_json_plotly(go.Figure()), 20)
+    _, new_time = timed(lambda: to_json_plotly(EMPTY_FIGURE), 20)
+    print(f"  {'empty':>6} {old_time * 1000:>8.2f}ms {new_time * 1000:>7.2f}ms {old_time / new_time:>7.1f}x")
+
+
+def run_stress(app, locks, writers, meters=64, readings=200, readers=2):
+    # writers ingest into their own meters through write_to_meter_data while readers run queries;
+    # returns (readings/s, queries/s), then checks that nothing was lost or double counted
+    start = 1735689600
+    history = 48 * 7
+    registration = [{"meterID": f"m{m}", "userID": f"u{m}", "region": "R", "area": f"A{m % 8}"}
+                    for m in range(meters)]
+    app.meter_data = {f"m{m}": half_hourly_series(history, start=start) for m in range(meters)}
+    app.registration_index = RegistrationIndex(registration)
+    app.query_cache = QueryCache()
+    app.meter_tiers = TieredStore(RetentionPolicy())
+    app.meter_tiers.sync_all(app.meter_data)
+    app.meter_locks = locks
+
+    def write(worker):
+        mine = [f"m{m}" for m in range(worker, meters, writers)]
+        for i in range(readings * len(mine)):
+            app.write_to_meter_data(mine[i % len(mine)], start + (history + i // len(mine)) * 1800,
+                                    float(history + i // len(mine)))
+
+    done = threading.Event()
+    queries = [0] * readers
+
+    def read(worker):
+        rng = random.Random(worker)
+        while not done.is_set():
+            m = rng.randrange(meters)
+            app.user_query_result(f"m{m}", "today")
+            app.area_query_result("R", f"A{m % 8}", "last_30_min")
+            queries[worker] += 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        app.meter_wal = WriteAheadLog(directory)
+        write_threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+        read_threads = [threading.Thread(target=read, args=(r,)) for r in range(readers)]
+        begin = time.perf_counter()
+        for thread in write_threads + read_threads:
+            thread.start()
+        for thread in write_threads:
+            thread.join()
+        elapsed = time.perf_counter() - begin
+        done.set()
+        for thread in read_threads:
+            thread.join()
+        app.meter_wal.close()
+        replayed = WriteAheadLog(directory)
+        wal_records = sum(1 for _ in replayed.replay())
+        replayed.close()
+
+    total = meters * readings
+    for meter_id, series in app.meter_data.items():
+        assert len(series) == history + readings, meter_id
+        assert all(a < b for a, b in zip(series.timestamps, series.timestamps[1:])), meter_id
+    assert wal_records == total, wal_records
+    return total / elapsed, sum(queries) / elapsed
+
+
+# concurrent ingest + queries: one global lock vs striped per-meter locks (also a stress test)
+def bench_concurrency():
+    import app_final
+    single = threading.Lock()
+    print("concurrency: 64 meters x 200 readings through write_to_meter_data, 2 query threads")
+    print(f"  {'writers':>7} {'one lock':>20} {'striped':>20}")
+    for writers in (1, 2, 4, 8):
+        cells = []
+        for locks in (lambda meter_id: single, StripedLock(64)):
+            ingest_rate, query_rate = run_stress(app_final, locks, writers)
+            cells.append(f"{ingest_rate:>8.0f}/s {query_rate:>6.0f}q/s")
+        print(f"  {writers:>7} {cells[0]:>20} {cells[1]:>20}")
+    print("  every run checked: no lost or duplicated readings, sorted series, wal complete")
+
+
+def old_format_meter_data(meter_data):
+    # what every user query used to run first: a walk over all readings of all meters
+    for meter_id in meter_data:
+        for entry in meter_data[meter_id]:
+            if isinstance(entry["timestamp"], str):
+                entry["timestamp"] = datetime.strptime(entry["timestamp"], "%Y-%m-%dT%H:%M:%S")
+
+
+# one user query ("today") as the number of meters in the system grows, one week of readings each
+def bench_query():
+    import app_final
+    start = 1735689600
+    print("query: user 'today' for one meter (uncached)")
+    print(f"  {'meters':>7} {'old format pass':>16} {'query':>9}")
+    for meters in (100, 1000, 10000):
+        series = half_hourly_series(48 * 7, start=start)
+        app_final.meter_data = {f"m{m}": series for m in range(meters)}
+        app_final.meter_locks = StripedLock(64)
+        entries = [{"timestamp": from_epoch(ts), "reading_kwh": kwh} for ts, kwh in series]
+        dict_data = {f"m{m}": entries for m in range(meters)}
+        _, old_time = timed(lambda: old_format_meter_data(dict_data), 3)
+        _, query_time = timed(lambda: app_final.user_query_result("m0", "today"), 20)
+        print(f"  {meters:>7} {old_time * 1000:>14.2f}ms {query_time * 1000:>7.3f}ms")
+
+
+def old_from_entries(entries):
+    # load path before the fast parser: strptime per reading, then one insert per reading
+    pairs = sorted(((datetime.strptime(e["timestamp"], "%Y-%m-%dT%H:%M:%S") - EPOCH) // ONE_SECOND,
+                    float(e["reading_kwh"])) for e in entries)
+    series = MeterSeries()
+    for ts, kwh in pairs:
+        series.insert(ts, kwh)
+    return series
+
+
+# timestamp parsing and the whole meter_data.json load, strptime vs fromisoformat vs numpy
+def bench_parse():
+    raw = load_raw_meter_data()
+    strings = [e["timestamp"] for entries in raw.values() for e in entries]
+    _, strptime_time = timed(lambda: [(datetime.strptime(s, TIME_FORMAT) - EPOCH) // ONE_SECOND for s in strings])
+    _, scalar_time = timed(lambda: [parse_timestamp(s) for s in strings])
+    _, vector_time = timed(lambda: parse_timestamps(strings))
+    print(f"parse: {len(strings)} timestamps from {METER_DATA_PATH}")
+    print(f"  strptime                 : {strptime_time * 1000:8.2f} ms")
+    print(f"  parse_timestamp (scalar) : {scalar_time * 1000:8.2f} ms")
+    print(f"  parse_timestamps (numpy) : {vector_time * 1000:8.2f} ms")
+
+    def load(from_entries):
+        with open(METER_DATA_PATH, 'r', encoding='utf-8') as f:
+            return {meter_id: from_entries(entries) for meter_id, entries in json.load(f).items()}
+
+    _, old_time = timed(lambda: load(old_from_entries))
+    _, new_time = timed(lambda: load(MeterSeries.from_entries))
+    print(f"  load json, old           : {old_time * 1000:8.2f} ms")
+    print(f"  load json, new           : {new_time * 1000:8.2f} ms")
+
+
+def measure_peak(build):
+    # highest traced allocation while build() runs
+    tracemalloc.start()
+    result = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+# meter file load: json.load of the whole document vs streaming one meter array at a time
+def bench_stream():
+    def whole(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return {meter_id: MeterSeries.from_entries(entries) for meter_id, entries in json.load(f).items()}
+
+    synthetic = os.path.join(tempfile.mkdtemp(), "meter_data.json")
+    with open(synthetic, 'w', encoding='utf-8') as f:
+        json.dump({f"m{m}": half_hourly_series(1440).to_entries() for m in range(300)}, f, indent=4)
+
+    print("stream: load meter json into MeterSeries")
+    print(f"  {'file':>22} {'size':>9} {'json.load peak':>15} {'stream peak':>12} {'json.load':>10} {'stream':>9}")
+    for path in (METER_DATA_PATH, synthetic):
+        size = os.path.getsize(path)
+        whole_data, whole_peak = measure_peak(lambda: whole(path))
+        stream_data, stream_peak = measure_peak(lambda: load_meter_json(path))
+        assert all(list(stream_data[m]) == list(series) for m, series in whole_data.items())
+        _, whole_time = timed(lambda: whole(path), 3)
+        _, stream_time = timed(lambda: load_meter_json(path), 3)
+        print(f"  {os.path.basename(path) if path == METER_DATA_PATH else '300 meters x 1440':>22}"
+              f" {size / 1e6:>7.1f}MB {whole_peak / 1e6:>13.1f}MB {stream_peak / 1e6:>10.1f}MB"
+              f" {whole_time * 1000:>8.0f}ms {stream_time * 1000:>7.0f}ms")
+    os.remove(synthetic)
+
+
+# save_meter's file: to_entries + json.dump(indent=4) as before vs streaming writer, indented and compact
+def bench_save():
+    meter_data = {f"m{m}": half_hourly_series(1440) for m in range(300)}
+    path = os.path.join(tempfile.mkdtemp(), "meter_data.json")
+
+    def old_save():
+        entries = {meter_id: series.to_entries() for meter_id, series in meter_data.items()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=4)
+
+    print("save: meter_data.json for 300 meters x 1440 readings")
+    print(f"  {'writer':>24} {'time':>9} {'size':>9} {'MB/s':>7} {'peak memory':>12}")
+    for name, save in (("json.dump indent=4", old_save),
+                       ("stream indent=4", lambda: write_meter_json(meter_data, path, indent=4)),
+                       ("stream compact", lambda: write_meter_json(meter_data, path))):
+        _, elapsed = timed(save, 3)
+        _, peak = measure_peak(save)
+        size = os.path.getsize(path)
+        print(f"  {name:>24} {elapsed * 1000:>7.0f}ms {size / 1e6:>7.1f}MB {size / 1e6 / elapsed:>7.1f}"
+              f" {peak / 1e6:>10.1f}MB")
+    os.remove(path)
+
+
+# background snapshot: how long ingestion is held for the point-in-time view vs copying every series
+def bench_snapshot():
+    import app_final
+    print("snapshot: point-in-time capture of meter data (1440 readings per meter)")
+    print(f"  {'meters':>7} {'capture pause':>14} {'full copy':>10} {'write':>9}")
+    for meters in (100, 1000, 10000):
+        app_final.meter_data = {f"m{m}": half_hourly_series(1440) for m in range(meters)}
+        app_final.registration_data = []
+        app_final.meter_locks = StripedLock(64)
+        app_final.meter_tiers = TieredStore(RetentionPolicy())
+        app_final.meter_tiers.sync_all(app_final.meter_data)
+        directory = tempfile.mkdtemp()
+        scheduler = SnapshotScheduler(directory, app_final.capture_data, retention=1)
+
+        begin = time.perf_counter()
+        _, _, release = app_final.capture_data()
+        pause = time.perf_counter() - begin
+        release()
+        _, copy_time = timed(lambda: app_final.copy_meter_data(app_final.meter_data), 3)
+        _, write_time = timed(scheduler.snapshot_now, 1)
+        assert len(scheduler.snapshots()) == 1
+        print(f"  {meters:>7} {pause * 1000:>12.2f}ms {copy_time * 1000:>8.1f}ms {write_time * 1000:>7.0f}ms")
+
+
+# tiered retention: points kept per meter as history grows, cost of folding readings into the tiers,
+# and a year of daily usage from raw readings vs from the tiers
+def bench_retention():
+    print("retention: one meter, half-hourly readings, default policy (35 raw / 180 hourly / 1095 daily days)")
+    print(f"  {'history':>8} {'raw kept':>9} {'tiers':>7} {'kept':>6} {'fold':>9}"
+          f" {'year of days: raw':>18} {'tiers':>17}")
+    for years in (1, 2, 3, 5):
+        series = half_hourly_series(years * 365 * 48)
+        count = len(series)
+        store = TieredStore(RetentionPolicy())
+
+        start = time.perf_counter()
+        for timestamp, reading_kwh in series:
+            store.fold("m", timestamp, reading_kwh)
+        fold_us = (time.perf_counter() - start) / count * 1e6
+        full = series.copy()
+        store.apply("m", series)
+        tier_points = sum(store.counts().values())
+
+        year = (full.timestamps[-1] - 365 * DAY) // DAY * DAY
+        raw_read, tier_read = full.slice(year), store.view("m", series, year, DAY).slice(year)
+        raw_days, raw_time = timed(lambda: bucket_usage(*full.slice(year), DAY))
+        tier_days, tier_time = timed(lambda: bucket_usage(*store.view("m", series, year, DAY).slice(year), DAY))
+        assert raw_days == tier_days
+        print(f"  {years:>7}y {len(series):>9} {tier_points:>7} {(len(series) + tier_points) / count:>6.1%}"
+              f" {fold_us:>7.2f}us {len(raw_read[0]):>6} pts {raw_time * 1000:>5.2f}ms"
+              f" {len(tier_read[0]):>6} pts {tier_time * 1000:>5.2f}ms")
+
+
+# per-meter work spread over processes: load meter_data.json, build tiers, save meter_data.json,
+# for 10k synthetic meters and 1, 2, 4, ... workers up to the number of cores
+def bench_parallel():
+    meters, per_meter = 10_000, 336
+    meter_data = {f"m{m:05d}": half_hourly_series(per_meter, start=1735689600 + m * 60) for m in range(meters)}
+    path = os.path.join(tempfile.mkdtemp(), "meter_data.json")
+    write_meter_json(meter_data, path)
+    cores = worker_count()
+    counts = sorted({1, 2, cores} | {2 ** i for i in range(1, 8) if 2 ** i < cores})
+    readings = meters * per_meter
+
+    print(f"parallel: {meters} meters x {per_meter} readings, {cores} core(s)")
+    print(f"  {'workers':>7} {'load':>17} {'tier build':>18} {'save':>17}")
+    first = None
+    for workers in counts:
+        loaded, load_time = timed(lambda: load_meter_json(path, workers=workers), 1)
+        assert len(loaded) == meters
+        _, build_time = timed(lambda: TieredStore().sync_all(meter_data, workers), 1)
+        _, save_time = timed(lambda: write_meter_json(meter_data, path, workers=workers), 1)
+        times = (load_time, build_time, save_time)
+        first = first or times
+        print(f"  {workers:>7}" + "".join(f" {t:>6.2f}s {first[i] / t:>4.1f}x {readings / t / 1e6:>3.1f}M/s"
+                                          for i, t in enumerate(times)))
+    os.remove(path)
+
+
+# background jobs: how long the aggregation callback held its request before (work done inline) and now
+# (job submitted), and what a status poll costs while the job runs
+def bench_jobs():
+    import app_final
+    meters = 2000
+
+    def setup():
+        app_final.meter_data = {f"m{m}": half_hourly_series(40 * 48) for m in range(meters)}
+        app_final.meter_tiers = TieredStore(RetentionPolicy())
+        app_final.meter_tiers.sync_all(app_final.meter_data)
+        app_final.registration_index = RegistrationIndex([])
+
+    setup()
+    start = time.perf_counter()
+    app_final.apply_retention()
+    inline = time.perf_counter() - start
+
+    setup()
+    client = app_final.app.server.test_client()
+    start = time.perf_counter()
+    job = app_final.job_scheduler.submit("Retention", app_final.apply_retention)
+    submitted = time.perf_counter() - start
+    polls = []
+    while job.state not in ("done", "failed", "cancelled"):
+        begin = time.perf_counter()
+        status = client.get(f"/api/jobs/{job.id}").get_json()
+        polls.append(time.perf_counter() - begin)
+    total = job.finished - job.created
+    assert job.state == "done" and status["id"] == job.id
+    polls.sort()
+    print(f"jobs: retention over {meters} meters (40 days each)")
+    print(f"  request held, inline     : {inline * 1000:8.1f} ms")
+    print(f"  request held, as a job   : {submitted * 1000:8.3f} ms (job itself {total * 1000:.1f} ms)")
+    print(f"  status poll while running: {polls[len(polls) // 2] * 1000:8.3f} ms median over {len(polls)} polls")
+
+
+# line-protocol ingestion server under a load generator (same process, so they share the cores):
+# in-memory store, then the app's handler (tiers, query cache, wal)
+def bench_ingest_server():
+    import asyncio
+    import app_final
+    readings = 100_000
+
+    def app_store(directory):
+        app_final.meter_data = {}
+        app_final.registration_index = RegistrationIndex([])
+        app_final.query_cache = QueryCache()
+        app_final.meter_tiers = TieredStore(RetentionPolicy())
+        app_final.meter_wal = WriteAheadLog(directory)
+        return app_final.write_batch_to_meter_data
+
+    print(f"ingest server: {readings} readings over 8 connections, 1000 meters each")
+    print(f"  {'store':<10} {'window':>6} {'readings/s':>11} {'p50 ack':>9} {'p99 ack':>9}")
+    for name in ("in memory", "app"):
+        for window in (100, 2000):
+            with tempfile.TemporaryDirectory() as directory:
+                handler = memory_handler() if name == "in memory" else app_store(directory)
+                server = IngestServer(handler, port=0).start()
+                result = asyncio.run(run_load(port=server.port, readings=readings, window=window))
+                server.stop()
+                if name == "app":
+                    app_final.meter_wal.close()
+                    replayed = WriteAheadLog(directory)
+                    replayed_count = sum(1 for _ in replayed.replay())
+                    replayed.close()
+                    assert replayed_count == readings, replayed_count
+            assert result["errors"] == 0 and result["readings"] == readings, result
+            print(f"  {name:<10} {window:>6} {result['readings_per_second']:>11,.0f} "
+                  f"{result['p50_ms']:>7.1f}ms {result['p99_ms']:>7.1f}ms")
+
+
+# ↓ Benchmark suite ↓
+# the hot paths of app_final.py on generated data far larger than meter_data.json (7 meters x 1886 readings);
+# the same seed and sizes give the same data, so runs on different commits can be compared
+SUITE_VERSION = 1
+SCALES = {  # meters with readings, half-hourly readings per meter, registrations
+    "small": (100, 1886, 200),
+    "medium": (1000, 4000, 2000),
+    "large": (10000, 2000, 20000),
+}
+REGIONS = {
+    "Central Region": ["Bishan", "Kallang", "Outram", "Toa Payoh"],
+    "East Region": ["Bedok", "Pasir Ris", "Tampines"],
+    "North East Region": ["Ang Mo Kio", "Hougang", "Sengkang", "Serangoon"],
+    "North Region": ["Sembawang", "Woodlands", "Yishun"],
+    "West Region": ["Bukit Batok", "Clementi", "Jurong East"],
+}
+QUERY_TYPES = ("last_30_min", "today", "yesterday", "past_week", "past_month")
+SYNTHETIC_END = 1740960000  # 2025-03-03T00:00:00, latest reading of every generated meter
+INSERTS = 2000  # readings per write_to_meter_data run
+USER_QUERIES = 1000  # (user, query type) pairs per handle_user_query run
+
+
+def synthetic_data(meters, readings, registrations, seed=0):
+    """meter_data (meterID -> MeterSeries) and registration records, the same for the same arguments.
+
+    Meter n gets the n-th registration, meters past the registrations have readings but are not
+    registered, registrations past the meters have no readings yet (a tenth of them no user either).
+    """
+    rng = random.Random(seed)
+    areas = [(region, area) for region, names in REGIONS.items() for area in names]
+    start = SYNTHETIC_END - (readings - 1) * 1800
+    meter_data = {}
+    registration = []
+    for number in range(max(meters, registrations)):
+        meter_id = f"{number // 1000000 % 1000:03d}-{number // 1000 % 1000:03d}-{number % 1000:03d}"
+        if number < registrations:
+            region, area = areas[rng.randrange(len(areas))]
+            bound = number < meters or rng.random() >= 0.1
+            registration.append({"userID": f"{number:06d}" if bound else "NA", "meterID": meter_id,
+                                 "area": area, "region": region})
+        if number < meters:
+            # cumulative register: a household's own base load, each half hour somewhere around it
+            base = rng.uniform(0.05, 0.6)
+            register = rng.uniform(0, 5000)
+            values = []
+            for _ in range(readings):
+                register += base * (0.5 + rng.random())
+                values.append(round(register, 3))
+            meter_data[meter_id] = MeterSeries(range(start, start + readings * 1800, 1800), values)
+    return meter_data, registration
+
+
+def set_up_app(app, meter_data, registration, directory, apply_retention=True):
+    # app_final's globals as its __main__ sets them up, over the given data, files in directory
+    app.registration_data_location = os.path.join(directory, "Registration.json")
+    app.meter_data_location = os.path.join(directory, "meter_data.json")
+    app.meter_snapshot_location = os.path.join(directory, "meter_data.snap")
+    app.meter_data = meter_data
+    app.registration_data = registration
+    app.registration_index = RegistrationIndex(registration)
+    app.query_cache = QueryCache(max_entries=1024, ttl=300)
+    app.meter_tiers = TieredStore(RetentionPolicy(app.RAW_DAYS, app.HOURLY_DAYS, app.DAILY_DAYS))
+    app.meter_tiers.sync_all(meter_data, app.PROCESS_WORKERS)
+    if apply_retention:
+        for meter_id, series in meter_data.items():
+            app.meter_tiers.apply(meter_id, series)
+    if getattr(app, "meter_wal", None) is not None:
+        app.meter_wal.close()
+    app.meter_wal = WriteAheadLog(tempfile.mkdtemp(dir=directory))
+
+
+def run_case(setup, run, repeat):
+    # run(setup()) `repeat` times for the best time, then once more under tracemalloc for the peak;
+    # setup is not measured, run gives back the number of operations it did
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        operations = run(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": best, "operations": operations, "per_second": operations / best, "peak_bytes": peak}
+
+
+def suite_cases(app, generated, registration, directory, files, seed):
+    # (name, setup, run) of every hot path, in the order they run; each run gives back its operation count
+    import types
+    total = sum(len(series) for series in generated.values())
+    rng = random.Random(seed + 1)  # which meters get readings and who queries what
+
+    def fresh_copy():
+        return {meter_id: series.copy() for meter_id, series in generated.items()}
+
+    def ready_app(apply_retention=True):
+        set_up_app(app, fresh_copy(), [dict(record) for record in registration], directory, apply_retention)
+
+    def read_json():
+        app.read_json_files(files["meter_data"], files["registration"])
+        return total
+
+    def read_snapshot():
+        # the snapshot is mapped lazily, a meter is read when first used, so every meter is opened here
+        meter_data, _ = app.read_json_files(files["meter_data"], files["registration"], files["snapshot"])
+        for series in meter_data.values():
+            series.latest()
+        return len(meter_data)
+
+    # every run inserts the next half hour of randomly picked meters, in order as meters report
+    next_reading = {}
+
+    def insert(_):
+        meter_ids = list(app.meter_data)
+        for _ in range(INSERTS):
+            meter_id = meter_ids[rng.randrange(len(meter_ids))]
+            series = app.meter_data[meter_id]
+            timestamp, reading = next_reading.get(meter_id) or series.latest()
+            next_reading[meter_id] = (timestamp + 1800, reading + 0.3)
+            result = app.write_to_meter_data(meter_id, format_timestamp(timestamp + 1800), reading + 0.3)
+            assert result == "Data inserted successfully!", result
+        return INSERTS
+
+    users = [record["userID"] for record in registration if record["userID"] != "NA"]
+    user_queries = [(users[rng.randrange(len(users))], QUERY_TYPES[rng.randrange(len(QUERY_TYPES))])
+                    for _ in range(USER_QUERIES)]
+    index = RegistrationIndex(registration)
+    area_queries = [(region, area, query_type) for region in index.regions()
+                    for area in index.areas_in(region) for query_type in QUERY_TYPES]
+
+    def user_query(_):
+        for user_id, query_type in user_queries:
+            app.handle_user_query(0, 1, user_id, query_type)
+        return len(user_queries)
+
+    def area_query(_):
+        for region, area, query_type in area_queries:
+            app.query_data(region, area, query_type)
+        return len(area_queries)
+
+    def empty_cache():
+        app.query_cache = QueryCache(max_entries=2 * (len(user_queries) + len(area_queries)), ttl=3600)
+
+    def filled_cache(query):
+        empty_cache()
+        query(None)
+
+    def aggregate(_):
+        app.aggregate_meter_data()
+        return total
+
+    ready_app()  # the ingest and query runs share one app state, as a running server would
+    app.ctx = types.SimpleNamespace(triggered_id="query-btn")  # as if the query button was clicked
+    return [
+        ("read_json_files (json)", lambda: None, lambda _: read_json()),
+        ("read_json_files (snapshot)", lambda: None, lambda _: read_snapshot()),
+        ("write_to_meter_data", lambda: None, insert),
+        ("handle_user_query (computed)", empty_cache, user_query),
+        ("handle_user_query (cached)", lambda: filled_cache(user_query), user_query),
+        ("query_data (computed)", empty_cache, area_query),
+        ("query_data (cached)", lambda: filled_cache(area_query), area_query),
+        ("aggregate_meter_data", lambda: ready_app(apply_retention=False), aggregate),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(report, baseline, threshold):
+    # prints the change against a saved run, gives back the names more than `threshold` slower
+    comparable = baseline.get("data") == report["data"]
+    if not comparable:
+        print(f"  note: baseline ran on other data ({baseline.get('data')}), nothing counted as slower")
+    print(f"  {'hot path':<30} {'time':>9} {'peak memory':>12}   vs {baseline.get('commit') or 'baseline'}")
+    slower = []
+    for name, result in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            print(f"  {name:<30} {'new':>9}")
+            continue
+        time_change = result["seconds"] / before["seconds"] - 1
+        memory_change = result["peak_bytes"] / before["peak_bytes"] - 1 if before["peak_bytes"] else 0.0
+        flag = "  slower" if comparable and time_change > threshold else ""
+        print(f"  {name:<30} {time_change:>+9.1%} {memory_change:>+12.1%}{flag}")
+        if flag:
+            slower.append(name)
+    return slower
+
+
+def run_suite(argv):
+    """python benchmark.py suite [--scale S | --meters N --readings N --registrations N] [--seed N]
+    [--repeat N] [--workers N] [--out results.json] [--compare baseline.json] [--threshold 0.25]
+
+    Exit status 1 when --compare finds a hot path slower than the baseline by more than the threshold;
+    compare runs of the same data on the same machine, paths that take a few ms vary by a fair bit.
+    """
+    parser = argparse.ArgumentParser(prog="benchmark.py suite")
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--meters", type=int)
+    parser.add_argument("--readings", type=int, help="half-hourly readings per meter")
+    parser.add_argument("--registrations", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per hot path, the best counts")
+    parser.add_argument("--workers", type=int, default=1, help="PROCESS_WORKERS for load / tier build / save")
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--compare", help="results json of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    import app_final
+    meters, readings, registrations = SCALES[args.scale]
+    meters = args.meters or meters
+    readings = args.readings or readings
+    registrations = args.registrations or registrations
+    app_final.PROCESS_WORKERS = args.workers
+    data = {"meters": meters, "readings_per_meter": readings, "registrations": registrations, "seed": args.seed}
+
+    start = time.perf_counter()
+    generated, registration = synthetic_data(meters, readings, registrations, args.seed)
+    print(f"suite: {meters} meters x {readings} readings, {registrations} registrations, seed {args.seed} "
+          f"(generated in {time.perf_counter() - start:.1f}s)")
+    print(f"  {'hot path':<30} {'time':>10} {'ops':>9} {'ops/s':>12} {'peak memory':>12}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        files = {"meter_data": os.path.join(directory, "meter_data.json"),
+                 "registration": os.path.join(directory, "Registration.json"),
+                 "snapshot": os.path.join(directory, "meter_data.snap")}
+        write_meter_json(generated, files["meter_data"])
+        with open(files["registration"], "w", encoding="utf-8") as f:
+            json.dump(registration, f, ensure_ascii=False, indent=4)
+        write_snapshot(generated, files["snapshot"])
+
+        for name, setup, run in suite_cases(app_final, generated, registration, directory, files, args.seed):
+            result = run_case(setup, run, args.repeat)
+            results[name] = result
+            print(f"  {name:<30} {result['seconds'] * 1000:>8.1f}ms {result['operations']:>9} "
+                  f"{result['per_second']:>12,.0f} {result['peak_bytes'] / 1e6:>10.1f}MB")
+        app_final.meter_wal.close()
+
+    report = {"suite": SUITE_VERSION, "commit": git_commit(), "created": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "repeat": args.repeat, "workers": args.workers, "data": data, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"  results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "startup": bench_startup,
+    "insert": bench_insert,
+    "bulk": bench_bulk,
+    "nearest": bench_nearest,
+    "area": bench_area,
+    "figure": bench_figure,
+    "concurrency": bench_concurrency,
+    "query": bench_query,
+    "parse": bench_parse,
+    "stream": bench_stream,
+    "save": bench_save,
+    "snapshot": bench_snapshot,
+    "retention": bench_retention,
+    "parallel": bench_parallel,
+    "jobs": bench_jobs,
+    "ingest_server": bench_ingest_server,
+}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(run_suite(sys.argv[2:]))
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,141 @@
+# Bulk reading ingestion: JSON Lines or CSV batches from the head-end systems
+#
+# JSON Lines : {"meter_id": "111-111-111", "timestamp": "2025-02-19T23:59:00", "reading_kwh": 906.5}
+# CSV        : meter_id,timestamp,reading_kwh   (header line optional)
+# meter_id and timestamp are strings (meter_id at most 255 utf-8 bytes, timestamp as YYYY-MM-DDTHH:MM:SS),
+# reading_kwh a finite number
+import csv
+import io
+import json
+import math
+from array import array
+
+from meter_store import (EARLIEST, MeterSeries, latest_allowed, meter_id_too_long, parse_timestamp,
+                         parse_timestamps)
+
+
+FIELDS = ("meter_id", "timestamp", "reading_kwh")
+ACCEPTED = "accepted"
+
+
+def parse_jsonl(text):
+    # one row per non-empty line, a line that is not a json object becomes an empty row (rejected later)
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = None
+        if isinstance(record, dict):
+            rows.append((record.get("meter_id"), record.get("timestamp"), record.get("reading_kwh")))
+        else:
+            rows.append((None, None, None))
+    return rows
+
+
+def parse_csv(text):
+    rows = []
+    for record in csv.reader(io.StringIO(text)):
+        if not record:
+            continue
+        if tuple(field.strip() for field in record) == FIELDS:
+            continue
+        if len(record) != 3:
+            rows.append((None, None, None))
+        else:
+            rows.append((record[0].strip(), record[1].strip(), record[2]))
+    return rows
+
+
+def prepare_batch(rows):
+    # validate every row once, then group by meter and sort each group by time
+    statuses = [None] * len(rows)
+    groups = {}
+    newest = latest_allowed()
+    # a clean batch gets its whole timestamp column parsed in one go, otherwise row by row
+    try:
+        parsed = parse_timestamps([timestamp for _, timestamp, _ in rows])
+    except (TypeError, ValueError):
+        parsed = None
+    for index, (meter_id, timestamp, reading_kwh) in enumerate(rows):
+        if not meter_id or timestamp is None or reading_kwh is None:
+            statuses[index] = "missing field"
+            continue
+        # json can carry any type: meter ids and timestamps must be strings (no epoch numbers, no true
+        # taken as 1), a reading a number or a numeric string but not a boolean
+        if not isinstance(meter_id, str) or meter_id_too_long(meter_id):
+            statuses[index] = "invalid meter_id"
+            continue
+        if not isinstance(timestamp, str):
+            statuses[index] = "invalid timestamp"
+            continue
+        try:
+            timestamp = parse_timestamp(timestamp) if parsed is None else parsed[index]
+        except (TypeError, ValueError):
+            statuses[index] = "invalid timestamp"
+            continue
+        # everything is checked here, before any series or tier changes: ingest_batch cannot fail halfway
+        if timestamp < EARLIEST:
+            statuses[index] = "invalid timestamp"
+            continue
+        if timestamp > newest:
+            statuses[index] = "timestamp in the future"
+            continue
+        try:
+            reading_kwh = math.nan if isinstance(reading_kwh, bool) else float(reading_kwh)
+        except (TypeError, ValueError):
+            reading_kwh = math.nan
+        if not math.isfinite(reading_kwh):
+            statuses[index] = "invalid reading"
+            continue
+        groups.setdefault(meter_id, []).append((timestamp, index, reading_kwh))
+
+    batches = {}
+    for meter_id, group in groups.items():
+        group.sort()
+        timestamps, readings, indexes = array("q"), array("d"), []
+        for timestamp, index, reading_kwh in group:
+            # same timestamp twice in one batch: the first row wins
+            if timestamps and timestamps[-1] == timestamp:
+                statuses[index] = "duplicate timestamp in batch"
+                continue
+            timestamps.append(timestamp)
+            readings.append(reading_kwh)
+            indexes.append(index)
+        batches[meter_id] = (timestamps, readings, indexes)
+    return statuses, batches
+
+
+def ingest_batch(meter_data, rows, locks, tiers=None):
+    # merge a batch into meter_data, returns (status per row, accepted (meter_id, timestamp, kWh) list)
+    # locks(meter_id) gives the lock to hold while a meter's series changes
+    statuses, batches = prepare_batch(rows)
+    accepted = []
+    for meter_id, (timestamps, readings, indexes) in batches.items():
+        series = meter_data.get(meter_id)
+        if series is None:
+            series = meter_data.setdefault(meter_id, MeterSeries())
+        with locks(meter_id):
+            # readings from before the kept raw window cannot be placed any more (see retention.py)
+            old = 0
+            while tiers is not None and old < len(timestamps) and tiers.too_old(meter_id, timestamps[old]):
+                statuses[indexes[old]] = "older than retention window"
+                old += 1
+            timestamps, readings, indexes = timestamps[old:], readings[old:], indexes[old:]
+            if not timestamps:
+                continue
+
+            results = series.merge(timestamps, readings)
+            if tiers is not None:
+                for ok, timestamp, reading_kwh in zip(results, timestamps, readings):
+                    if ok:
+                        tiers.fold(meter_id, timestamp, reading_kwh)
+        for ok, timestamp, reading_kwh, index in zip(results, timestamps, readings, indexes):
+            if ok:
+                statuses[index] = ACCEPTED
+                accepted.append((meter_id, timestamp, reading_kwh))
+            else:
+                statuses[index] = "duplicate timestamp"
+    return statuses, accepted
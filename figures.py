@@ -0,0 +1,39 @@
+# Pre-serialized Plotly figures for the query callbacks
+#
+# the layouts (template included) go through plotly's validation and serialization once, at import,
+# after that a figure is a plain dict holding the bar trace and a shared layout, which Dash sends as it is.
+# The shared dicts are never modified, callers only build new trace dicts around them.
+import plotly.graph_objects as go
+
+
+# empty chart for error / idle answers
+EMPTY_FIGURE = go.Figure().to_plotly_json()
+
+USER_LAYOUT = go.Layout(
+    title="Electricity Consumption",
+    xaxis_title="Time Period",
+    yaxis_title="Consumption (kWh)",
+    xaxis=dict(showgrid=True, tickangle=45),
+    yaxis=dict(showgrid=True),
+    template="plotly_white"
+).to_plotly_json()
+
+
+def gov_layout(x_title):
+    return go.Layout(
+        title="Electricity Consumption Over Selected Period",
+        xaxis_title=x_title,
+        yaxis_title="Cumulative Usage (kWh)",
+        template="plotly_white"
+    ).to_plotly_json()
+
+
+GOV_LAYOUTS = {"Time": gov_layout("Time"), "Date": gov_layout("Date")}
+
+
+def bar_figure(layout, x, y, name, color=None):
+    # same dict go.Figure(go.Bar(...)).to_plotly_json() gives, without building the objects
+    trace = {"type": "bar", "x": list(x), "y": list(y), "name": name}
+    if color is not None:
+        trace["marker"] = {"color": color}
+    return {"data": [trace], "layout": layout}
@@ -0,0 +1,265 @@
+# Line-protocol ingestion server for head-end systems, next to the Dash app but not going through it
+#
+# TCP, one reading per line, connections stay open for as long as the client likes:
+#   client: meter_id,timestamp,reading_kwh\n      e.g. 111-111-111,2025-02-19T23:59:00,906.5
+#   server: OK\n  or  ERR <reason>\n               one answer per reading, in order
+# An answer is sent once the reading is in the store (and, with the app's handler, on disk in the wal).
+#
+# Lines read from all connections are queued and handed to handler(rows) -> statuses in batches, so many
+# small writes share one store update / wal fsync. Backpressure: a connection reads no more until its
+# last answers are written (drain), and the queue in front of the handler is bounded, so a client that
+# sends faster than the store takes waits in TCP instead of filling memory.
+#
+# python ingest_server.py serve [port]            in-memory store, for trying the protocol
+# python ingest_server.py load [port] [readings]  load generator, reports readings/s and ack latency
+import asyncio
+import sys
+import threading
+import time
+from collections import deque
+
+from bulk_ingest import ACCEPTED
+from meter_store import format_timestamp
+
+
+DEFAULT_PORT = 6667
+READ_SIZE = 1 << 16
+MAX_LINE = 1024
+
+
+def parse_line(line):
+    # b"meter_id,timestamp,reading_kwh" -> row for the handler, anything else an empty row (rejected)
+    try:
+        fields = line.decode("utf-8").split(",")
+    except UnicodeDecodeError:
+        return None, None, None
+    if len(fields) != 3:
+        return None, None, None
+    return fields[0].strip(), fields[1].strip(), fields[2].strip()
+
+
+def answer(status):
+    return b"OK\n" if status == ACCEPTED else f"ERR {status}\n".encode("utf-8")
+
+
+class IngestServer:
+    """asyncio TCP server feeding readings to handler(rows) in batches."""
+
+    def __init__(self, handler, host="127.0.0.1", port=DEFAULT_PORT, max_batch=5000, max_queued=64,
+                 writers=2, idle_timeout=300):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch  # rows per handler call
+        self.max_queued = max_queued  # connection batches waiting for the handler
+        self.writers = writers  # handler calls running at the same time
+        self.idle_timeout = idle_timeout  # seconds a silent connection is kept open
+        self.accepted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._error = None  # why serve() could not start listening, raised again by start()
+
+    def stats(self):
+        return {"accepted": self.accepted, "rejected": self.rejected, "batches": self.batches,
+                "connections": self.connections}
+
+    async def _write_batches(self, queue):
+        # takes what is queued (up to max_batch rows) and stores it in one handler call, on a thread,
+        # the handler blocks (locks, fsync)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            count = len(batch[0][0])
+            while count < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+                count += len(batch[-1][0])
+            rows = [row for lines, _ in batch for row in lines]
+            try:
+                statuses = await loop.run_in_executor(None, self.handler, rows)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            position = 0
+            for lines, future in batch:
+                future.set_result(statuses[position:position + len(lines)])
+                position += len(lines)
+
+    async def _connection(self, reader, writer, queue):
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        pending = b""
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(READ_SIZE), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b"\n")
+                if len(pending) > MAX_LINE:
+                    writer.write(b"ERR line too long\n")
+                    break
+                rows = [parse_line(line) for line in lines if line.strip()]
+                if not rows:
+                    continue
+
+                future = loop.create_future()
+                await queue.put((rows, future))  # waits while the handler is behind
+                try:
+                    statuses = await future
+                except Exception as e:
+                    statuses = [f"server error: {e}"] * len(rows)
+                accepted = statuses.count(ACCEPTED)
+                self.accepted += accepted
+                self.rejected += len(statuses) - accepted
+                writer.write(b"".join(map(answer, statuses)))
+                await writer.drain()  # a client that does not read its answers is not read either
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # server stopped with the connection still open
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, ready=None):
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.max_queued)
+        writers = [asyncio.create_task(self._write_batches(queue)) for _ in range(self.writers)]
+        try:
+            self._server = await asyncio.start_server(
+                lambda reader, writer: self._connection(reader, writer, queue), self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]  # port=0 picks a free one
+        except Exception as e:
+            self._error = e  # e.g. the port is taken
+            for task in writers:
+                task.cancel()
+            raise
+        finally:
+            if ready is not None:
+                ready.set()  # also on failure, start() must not wait forever
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass  # stop() closed the server
+        finally:
+            for task in writers:
+                task.cancel()
+
+    def start(self):
+        # runs the server on its own thread and event loop, returns once it listens
+        # or raises what stopped it from listening (OSError when the port is taken)
+        ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+        return self
+
+    def _run(self, ready):
+        try:
+            asyncio.run(self.serve(ready))
+        except Exception:
+            if self._error is None:
+                raise  # failed after it was listening, nobody waits for it: let the thread report it
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join()
+
+
+async def _load_connection(host, port, lines, window, latencies):
+    # sends lines with at most `window` unanswered, records the time from sending a line to its answer
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = deque()  # send time of every unanswered line
+    errors = 0
+    can_send = asyncio.Event()
+    can_send.set()
+
+    async def send():
+        for start in range(0, len(lines), 500):
+            await can_send.wait()
+            chunk = lines[start:start + 500]
+            now = time.perf_counter()
+            sent.extend([now] * len(chunk))
+            writer.write(b"".join(chunk))
+            await writer.drain()
+            if len(sent) >= window:
+                can_send.clear()
+
+    sender = asyncio.create_task(send())
+    for _ in range(len(lines)):
+        reply = await reader.readline()
+        if not reply:
+            raise ConnectionError("server closed the connection")
+        latencies.append(time.perf_counter() - sent.popleft())
+        errors += reply != b"OK\n"
+        if len(sent) < window:
+            can_send.set()
+    await sender
+    writer.close()
+    return errors
+
+
+async def run_load(host="127.0.0.1", port=DEFAULT_PORT, readings=200_000, connections=8, meters=1000,
+                   window=2000):
+    """Sends `readings` synthetic readings over `connections` connections; returns a result dict."""
+    start_time = 1735689600
+    per_connection = readings // connections
+    jobs = []
+    for c in range(connections):
+        lines = []
+        for i in range(per_connection):
+            step, meter = divmod(i, meters)
+            lines.append(f"load-{c:03d}-{meter:05d},{format_timestamp(start_time + step * 1800)},{step * 0.5}\n"
+                         .encode())
+        jobs.append(lines)
+
+    latencies = []
+    begin = time.perf_counter()
+    errors = await asyncio.gather(*[_load_connection(host, port, lines, window, latencies) for lines in jobs])
+    elapsed = time.perf_counter() - begin
+    latencies.sort()
+    return {"readings": len(latencies), "errors": sum(errors), "seconds": elapsed,
+            "readings_per_second": len(latencies) / elapsed,
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+def memory_handler():
+    # handler over an in-memory store, for `serve` and the benchmark
+    from bulk_ingest import ingest_batch
+    from meter_store import StripedLock
+    meter_data, locks = {}, StripedLock()
+    return lambda rows: ingest_batch(meter_data, rows, locks)[0]
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    if command == "serve":
+        server = IngestServer(memory_handler(), port=port)
+        print(f"Ingesting on port {port} (in-memory store), Ctrl+C to stop")
+        asyncio.run(server.serve())
+    elif command == "load":
+        readings = int(sys.argv[3]) if len(sys.argv) > 3 else 200_000
+        result = asyncio.run(run_load(port=port, readings=readings))
+        print(f"{result['readings']} readings in {result['seconds']:.2f}s: "
+              f"{result['readings_per_second']:,.0f} readings/s, ack latency p50 {result['p50_ms']:.1f} ms, "
+              f"p99 {result['p99_ms']:.1f} ms, {result['errors']} errors")
+    else:
+        print("usage: python ingest_server.py serve [port] | load [port] [readings]")
+        sys.exit(1)
@@ -0,0 +1,127 @@
+# Background jobs: long work (aggregation, long government queries) runs off the Dash request thread
+#
+# submit() gives back a Job at once, its id is what the page keeps and polls; the work runs on a small
+# thread pool (it reads meter_data in this process, a process pool would not see it). A job reports its
+# progress and checks for cancellation itself, a job still waiting in the queue is cancelled right away.
+# Finished jobs are kept for a while so their result can be picked up, the oldest ones are dropped.
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job by check() once it has been asked to stop."""
+
+
+class Job:
+    """One piece of background work and what is known about it."""
+
+    def __init__(self, job_id, name, key=None):
+        self.id = job_id
+        self.name = name
+        self.key = key
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED
+
+    def report(self, done, total, message=None):
+        # called by the job: done out of total steps
+        self.progress = min(1.0, done / total) if total else 1.0
+        if message is not None:
+            self.message = message
+
+    def check(self):
+        # called by the job between steps, stops it once cancel() was asked for
+        if self._cancel.is_set():
+            raise JobCancelled
+
+    def status(self):
+        # what the status endpoint sends, the result is fetched separately
+        return {"id": self.id, "name": self.name, "state": self.state, "progress": round(self.progress, 3),
+                "message": self.message, "error": self.error,
+                "created": self.created, "started": self.started, "finished": self.finished}
+
+
+class JobScheduler:
+    """Runs jobs on `workers` threads and keeps the newest `keep` finished ones."""
+
+    def __init__(self, workers=2, keep=100):
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()  # id -> Job, oldest first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, name, function, *args, key=None):
+        # function(job, *args) runs in the background; with a key, a job with the same key that is not
+        # finished yet is given back instead of starting the same work twice
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and not job.finished_state:
+                        return job
+            job = Job(f"{next(self._ids):06d}", name, key)
+            self._jobs[job.id] = job
+            self._prune()
+        job._future = self._pool.submit(self._run, job, function, args)
+        return job
+
+    def _run(self, job, function, args):
+        if job._cancel.is_set():
+            job.state, job.finished = CANCELLED, time.time()
+            return
+        job.state, job.started = RUNNING, time.time()
+        try:
+            job.result = function(job, *args)
+            job.state = DONE
+            job.progress = 1.0
+        except JobCancelled:
+            job.state = CANCELLED
+        except Exception as e:
+            job.state, job.error = FAILED, f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_state]
+        for job_id in finished[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        # False if there is no such job or it has already finished
+        job = self._jobs.get(job_id)
+        if job is None or job.finished_state:
+            return False
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            job.state, job.finished = CANCELLED, time.time()
+        return True
+
+    def shutdown(self):
+        for job in self.jobs():
+            self.cancel(job.id)
+        self._pool.shutdown(wait=True)
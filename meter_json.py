@@ -0,0 +1,270 @@
+# Streaming reader / writer for meter_data.json
+#
+# the file is one object {meterID: [{"timestamp": ..., "reading_kwh": ...}, ...], ...}; it is read in chunks
+# and decoded one meter array at a time, each array becomes a MeterSeries before the next one is read,
+# so the whole text and the whole dict-of-lists tree are never in memory together.
+# Malformed files raise json.JSONDecodeError with the line / column in the file, like json.load.
+# Writing goes the other way round, meter by meter straight from the columns.
+# With workers > 1 (parallel.py) the arrays are not decoded here: the text of each one goes to a worker
+# process, which decodes it and sends the columns back; saving formats meters in the workers the same way.
+import json
+import math
+import os
+import re
+from contextlib import contextmanager
+from json.decoder import WHITESPACE
+
+from meter_store import MeterSeries, format_timestamps
+from parallel import map_meters, pack, unpack, worker_count
+
+
+CHUNK_SIZE = 1 << 18
+# the inside of an array up to its closing bracket: anything but quotes and brackets, and whole strings
+ARRAY_BODY = re.compile(r'(?:[^"\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+
+
+class _ChunkReader:
+    """Text buffer over a file: decodes JSON values from it, reading more when a value is cut off."""
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        # where the buffer starts in the file, for error positions
+        self.offset = 0
+        self.lines = 0
+        self.column = 0
+
+    def _fill(self, at_least=0):
+        text = self.file.read(max(self.chunk_size, at_least))
+        if not text:
+            self.eof = True
+            return False
+        self.buffer += text
+        return True
+
+    def peek(self):
+        # next character that is not whitespace, "" at the end of the file
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof or not self._fill():
+                return ""
+
+    def decode(self):
+        # one JSON value at pos; a value cut off by the end of the buffer is retried with twice the text,
+        # a value that still fails at the end of the file is a real error
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError as e:
+                if self.eof or not self._fill(len(self.buffer) - self.pos):
+                    raise self.error(e.msg, e.pos)
+
+    def span(self):
+        # text of the array at pos without decoding it, None when it is not a flat array
+        # (or not an array at all), which only the decoder can say what is wrong with
+        while self.buffer.startswith("[", self.pos):
+            end = ARRAY_BODY.match(self.buffer, self.pos + 1).end()
+            if end < len(self.buffer) and self.buffer[end] == "]":
+                text = self.buffer[self.pos:end + 1]
+                self.pos = end + 1
+                return text
+            if end < len(self.buffer) and self.buffer[end] == "[":
+                return None
+            if self.eof or not self._fill(len(self.buffer) - self.pos):
+                return None
+        return None
+
+    def discard(self):
+        # forget the text before pos
+        done = self.buffer[:self.pos]
+        newlines = done.count("\n")
+        self.lines += newlines
+        self.column = len(done) - done.rfind("\n") - 1 if newlines else self.column + len(done)
+        self.offset += len(done)
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+    def error(self, msg, pos=None):
+        pos = self.pos if pos is None else pos
+        error = json.JSONDecodeError(msg, self.buffer, pos)
+        newlines = self.buffer.count("\n", 0, pos)
+        error.pos = self.offset + pos
+        error.lineno = self.lines + newlines + 1
+        error.colno = pos - self.buffer.rfind("\n", 0, pos) if newlines else self.column + pos + 1
+        error.args = (f"{msg}: line {error.lineno} column {error.colno} (char {error.pos})",)
+        return error
+
+
+class _Unusual(Exception):
+    """A meter array the parallel reader leaves to the single-process one."""
+
+
+def _meters(reader, as_text):
+    # (meterID, array) for every meter of the top-level object, the array decoded or (as_text) its text
+    if reader.peek() != "{":
+        raise reader.error("Expecting value" if reader.peek() == "" else "Expecting '{'")
+    reader.pos += 1
+
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            if reader.peek() != '"':
+                raise reader.error("Expecting property name enclosed in double quotes")
+            meter_id = reader.decode()
+            if reader.peek() != ":":
+                raise reader.error("Expecting ':' delimiter")
+            reader.pos += 1
+            if reader.peek() == "":
+                raise reader.error("Expecting value")
+            if as_text:
+                entries = reader.span()
+                if entries is None:
+                    raise _Unusual
+            else:
+                entries = reader.decode()
+            reader.discard()
+            yield meter_id, entries
+
+            separator = reader.peek()
+            if separator == "}":
+                reader.pos += 1
+                break
+            if separator != ",":
+                raise reader.error("Expecting ',' delimiter")
+            reader.pos += 1
+
+    if reader.peek() != "":
+        raise reader.error("Extra data")
+
+
+def _columns_from_json(text):
+    # worker side: one meter array -> packed columns, a bad entry is sent back to be raised at the end
+    try:
+        entries = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    try:
+        return pack(MeterSeries.from_entries(entries))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return e
+
+
+def load_meter_json(path, chunk_size=CHUNK_SIZE, workers=1):
+    """meter_data.json -> {meterID: MeterSeries}, one meter array in memory at a time.
+
+    With workers > 1 the arrays are decoded by that many processes; a file that needs an error message
+    is read again by this process alone, so the message is the same either way.
+    """
+    if worker_count(workers) > 1:
+        try:
+            return _load_parallel(path, chunk_size, workers)
+        except _Unusual:
+            pass
+
+    meter_data = {}
+    bad_entries = None  # json.load would report a syntax error further down first, so this waits
+    with open(path, 'r', encoding='utf-8') as file:
+        for meter_id, entries in _meters(_ChunkReader(file, chunk_size), False):
+            try:
+                meter_data[meter_id] = MeterSeries.from_entries(entries)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                bad_entries = bad_entries or e
+    if bad_entries is not None:
+        raise bad_entries
+    return meter_data
+
+
+def _load_parallel(path, chunk_size, workers):
+    meter_data = {}
+    bad_entries = None
+    with open(path, 'r', encoding='utf-8') as file:
+        arrays = ((meter_id, (text,)) for meter_id, text in _meters(_ChunkReader(file, chunk_size), True))
+        for meter_id, columns in map_meters(_columns_from_json, arrays, workers):
+            if columns is None:
+                raise _Unusual
+            if isinstance(columns, Exception):
+                bad_entries = bad_entries or columns
+            else:
+                meter_data[meter_id] = unpack(columns)
+    if bad_entries is not None:
+        raise bad_entries
+    return meter_data
+
+
+@contextmanager
+def atomic_open(path):
+    # text file written as path.tmp and renamed over path once complete and on disk,
+    # a crash while writing leaves the old file as it was
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _number(value):
+    # float as json.dump writes it
+    return repr(value) if math.isfinite(value) else json.dumps(value)
+
+
+def _layout(indent):
+    # (open meter, close meter, meter separator, empty meter, entry, entry separator) of the written text
+    if indent is None:
+        return "{}:[", "]", ",", "{}:[]", '{{"timestamp":"{}","reading_kwh":{}}}', ","
+    pad1, pad2, pad3 = (" " * (indent * level) for level in (1, 2, 3))
+    return (pad1 + "{}: [\n" + pad2, "\n" + pad1 + "]", ",\n", pad1 + "{}: []",
+            "{{\n" + pad3 + '"timestamp": "{}",\n' + pad3 + '"reading_kwh": {}\n' + pad2 + "}}", ",\n" + pad2)
+
+
+def _meter_text(meter_id, series, indent):
+    open_meter, close_meter, _, empty_meter, entry, entry_separator = _layout(indent)
+    key = json.dumps(meter_id, ensure_ascii=False)
+    if not len(series):
+        return empty_meter.format(key)
+    return (open_meter.format(key)
+            + entry_separator.join(map(entry.format, format_timestamps(series.timestamps),
+                                       map(_number, series.readings)))
+            + close_meter)
+
+
+def _packed_meter_text(meter_id, columns, indent):
+    # worker side of _meter_text
+    return _meter_text(meter_id, unpack(columns), indent)
+
+
+def write_meter_json(meter_data, path, indent=None, workers=1):
+    """{meterID: MeterSeries} -> meter_data.json, written atomically and meter by meter.
+
+    indent=None writes compact json, indent=4 the same text as json.dump(..., indent=4);
+    the series are only read, a copy should be passed if readings can arrive meanwhile.
+    With workers > 1 meters are formatted by that many processes and written in order.
+    """
+    meter_separator = _layout(indent)[2]
+    if worker_count(workers) > 1:
+        texts = (text for _, text in map_meters(
+            _packed_meter_text, ((meter_id, (meter_id, pack(series), indent))
+                                 for meter_id, series in meter_data.items()), workers))
+    else:
+        texts = (_meter_text(meter_id, series, indent) for meter_id, series in meter_data.items())
+
+    with atomic_open(path) as f:
+        f.write("{" if indent is None or not meter_data else "{\n")
+        for number, text in enumerate(texts):
+            if number:
+                f.write(meter_separator)
+            f.write(text)
+        f.write("}" if indent is None or not meter_data else "\n}")
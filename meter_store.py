@@ -0,0 +1,361 @@
+# Compact storage for meter readings
+# every meter keeps two parallel columns: epoch seconds (int64) and reading in kWh (float64)
+import bisect
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np  # only for parse_timestamps on big lists
+except ImportError:
+    np = None
+
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+MAX_AHEAD = 86400  # seconds a reading may be ahead of this machine's clock (meter clocks, time zones)
+MAX_METER_ID_BYTES = 255  # utf-8; the wal and the snapshot index store a meter id's length in 16 bits
+
+
+def to_epoch(dt):
+    # naive datetime -> whole seconds since 1970-01-01
+    return (dt - EPOCH) // ONE_SECOND
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def meter_id_too_long(meter_id):
+    return len(meter_id.encode("utf-8")) > MAX_METER_ID_BYTES
+
+
+def latest_allowed():
+    # newest timestamp a reading may have now; a typo far in the future would otherwise become the
+    # meter's newest reading and move its retention cuts (retention.py) past all of its real data
+    return to_epoch(datetime.now()) + MAX_AHEAD
+
+
+def parse_timestamp(value):
+    # accept "YYYY-MM-DDTHH:MM:SS", datetime or epoch seconds, always give back epoch seconds
+    if isinstance(value, str):
+        # exactly our format (ascii digits where ISO_TEMPLATE has "0", its separators elsewhere) goes
+        # through fromisoformat (C, ~15x faster than strptime), anything else still through strptime,
+        # so the same strings pass and fail as before (fromisoformat alone takes e.g. week dates)
+        if (len(value) == 19 and value.isascii()
+                and value[4] == value[7] == "-" and value[10] == "T" and value[13] == value[16] == ":"
+                and (value[:4] + value[5:7] + value[8:10] + value[11:13] + value[14:16] + value[17:]).isdigit()):
+            try:
+                return to_epoch(datetime.fromisoformat(value))
+            except ValueError:
+                pass
+        return to_epoch(datetime.strptime(value, TIME_FORMAT))
+    if isinstance(value, datetime):
+        return to_epoch(value)
+    return int(value)
+
+
+ISO_TEMPLATE = "0000-00-00T00:00:00"  # "0" marks a digit
+EARLIEST = to_epoch(datetime.min)  # 0001-01-01T00:00:00, numpy also takes year 0000, datetime does not
+
+
+def parse_timestamps(values):
+    # a whole list at once -> array of epoch seconds; with numpy, lists made only of
+    # "YYYY-MM-DDTHH:MM:SS" strings are parsed in one datetime64 call, the rest one by one
+    if np is not None and len(values) >= 64:
+        strings = np.asarray(values)
+        if strings.dtype == np.dtype("<U19") and (np.char.str_len(strings) == 19).all():
+            # check the shape on the code points: ascii digits and our separators only
+            codes = strings.view(np.uint32).reshape(-1, 19)
+            template = np.array([ord(c) for c in ISO_TEMPLATE], dtype=np.uint32)
+            if np.where(template == ord("0"), codes - ord("0") < 10, codes == template).all():
+                try:
+                    seconds = np.array(values, dtype="datetime64[s]").astype(np.int64)
+                except ValueError:
+                    seconds = None  # e.g. a bad date, parse one by one to fail the usual way
+                if seconds is not None and seconds.min() >= EARLIEST:
+                    return array("q", seconds.tobytes())
+    return array("q", [parse_timestamp(value) for value in values])
+
+
+def format_timestamp(seconds):
+    return from_epoch(seconds).strftime(TIME_FORMAT)
+
+
+# years 1000..9999, where numpy and strftime write the same four digit year
+FORMAT_RANGE = (-30610224000, 253402300800)
+
+
+def format_timestamps(timestamps):
+    # sorted epoch seconds -> list of time strings, in one numpy call when possible
+    if (np is not None and len(timestamps) >= 64
+            and FORMAT_RANGE[0] <= timestamps[0] and timestamps[-1] < FORMAT_RANGE[1]):
+        return np.frombuffer(timestamps, dtype=np.int64).astype("datetime64[s]").astype(str).tolist()
+    return [format_timestamp(ts) for ts in timestamps]
+
+
+def _bisect_left(items, target, key):
+    # bisect.bisect_left with a key, for lists of reading dicts
+    if key is None:
+        return bisect.bisect_left(items, target)
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(items[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def nearest_index(timestamps, target, tie="earlier", max_gap=None, key=None):
+    # index of the timestamp closest to target in a sorted sequence, None if empty or further than max_gap
+    # tie: "earlier" or "later" sample wins when both are equally far away
+    index = _bisect_left(timestamps, target, key)
+    if key is None:
+        key = lambda item: item
+    if index == len(timestamps):
+        if index == 0:
+            return None
+        index -= 1
+    elif index > 0:
+        before = target - key(timestamps[index - 1])
+        after = key(timestamps[index]) - target
+        if before < after or (before == after and tie == "earlier"):
+            index -= 1
+
+    if max_gap is not None:
+        if isinstance(max_gap, timedelta) and not isinstance(target, datetime):
+            max_gap = max_gap.total_seconds()
+        if abs(key(timestamps[index]) - target) > max_gap:
+            return None
+    return index
+
+
+def get_reading_at(readings, target_time, tie="earlier", max_gap=None):
+    # closest reading in a list of {"timestamp", "reading_kwh"} dicts sorted by timestamp
+    index = nearest_index(readings, target_time, tie, max_gap, key=lambda r: r["timestamp"])
+    return readings[index]["reading_kwh"] if index is not None else None
+
+
+def bucket_usage(timestamps, readings, width):
+    # usage per bucket of `width` seconds, from sorted register columns, one bisect per bucket
+    # the step from one reading to the next is counted in the bucket of the earlier reading
+    usage = []
+    last = len(timestamps) - 1
+    lo = 0
+    while lo < last:
+        bucket = timestamps[lo] - timestamps[lo] % width
+        hi = bisect.bisect_left(timestamps, bucket + width, lo)
+        usage.append((bucket, readings[min(hi, last)] - readings[lo]))
+        lo = hi
+    return usage
+
+
+class MeterSeries:
+    """Readings of one meter, sorted by time and stored column by column."""
+
+    __slots__ = ("timestamps", "readings", "_source", "_shared")
+
+    def __init__(self, timestamps=None, readings=None):
+        self.timestamps = array("q", timestamps or [])
+        self.readings = array("d", readings or [])
+        self._source = None
+        self._shared = False
+
+    @classmethod
+    def from_buffer(cls, buffer, ts_offset, kwh_offset, count, swap=False):
+        # columns stay in the buffer (e.g. a mmap of a snapshot) until the series is first used
+        series = cls.__new__(cls)
+        series._source = (buffer, ts_offset, kwh_offset, count, swap)
+        series._shared = False
+        return series
+
+    def __getattr__(self, name):
+        # only called while the columns are not loaded yet
+        if name in ("timestamps", "readings") and self._source is not None:
+            self._load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _load(self):
+        buffer, ts_offset, kwh_offset, count, swap = self._source
+        timestamps = array("q")
+        timestamps.frombytes(buffer[ts_offset:ts_offset + count * 8])
+        readings = array("d")
+        readings.frombytes(buffer[kwh_offset:kwh_offset + count * 8])
+        if swap:
+            timestamps.byteswap()
+            readings.byteswap()
+        self.timestamps = timestamps
+        self.readings = readings
+        self._source = None
+
+    @classmethod
+    def from_entries(cls, entries):
+        # entries look like meter_data.json: [{"timestamp": ..., "reading_kwh": ...}, ...]
+        # sorted by time, of readings with the same timestamp the first after sorting is kept
+        timestamps = parse_timestamps([e["timestamp"] for e in entries])
+        pairs = sorted(zip(timestamps, [float(e["reading_kwh"]) for e in entries]))
+        series = cls()
+        for ts, kwh in pairs:
+            if not series.timestamps or ts > series.timestamps[-1]:
+                series.timestamps.append(ts)
+                series.readings.append(kwh)
+        return series
+
+    def copy(self):
+        return MeterSeries(self.timestamps, self.readings)
+
+    def frozen(self):
+        # read-only view of the columns as they are now, without copying them (copy on write):
+        # until release(), the next change of this series copies its columns first
+        self._shared = True
+        view = MeterSeries.__new__(MeterSeries)
+        view.timestamps, view.readings = self.timestamps, self.readings
+        view._source, view._shared = None, True
+        return view
+
+    def release(self, view):
+        # the view is not used any more, stop copying if the columns were not changed meanwhile
+        if self.timestamps is view.timestamps:
+            self._shared = False
+
+    def _own(self):
+        # called before every change
+        if self._shared:
+            self.timestamps = self.timestamps[:]
+            self.readings = self.readings[:]
+            self._shared = False
+
+    def to_entries(self):
+        return [{"timestamp": format_timestamp(ts), "reading_kwh": kwh}
+                for ts, kwh in zip(self.timestamps, self.readings)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        return zip(self.timestamps, self.readings)
+
+    def append(self, timestamp, reading_kwh):
+        # only for readings newer than everything we already have
+        if self.timestamps and timestamp <= self.timestamps[-1]:
+            raise ValueError("timestamp is not after the latest reading")
+        self._own()
+        self.timestamps.append(timestamp)
+        self.readings.append(reading_kwh)
+
+    def insert(self, timestamp, reading_kwh):
+        # put the reading at its place in time, return False for a duplicate timestamp
+        self._own()
+        timestamps = self.timestamps
+
+        # fast path: newer than everything we have, nothing to search or shift
+        if not timestamps or timestamp > timestamps[-1]:
+            timestamps.append(timestamp)
+            self.readings.append(reading_kwh)
+            return True
+
+        # late reading: one binary search finds both a duplicate and the insert place
+        index = bisect.bisect_left(timestamps, timestamp)
+        if timestamps[index] == timestamp:
+            return False
+        timestamps.insert(index, timestamp)
+        self.readings.insert(index, reading_kwh)
+        return True
+
+    def replace(self, index, timestamp, reading_kwh):
+        # overwrite one reading, the caller keeps the series sorted
+        self._own()
+        self.timestamps[index] = timestamp
+        self.readings[index] = reading_kwh
+
+    def drop_before(self, timestamp):
+        # forget readings older than timestamp, returns how many
+        count = bisect.bisect_left(self.timestamps, timestamp)
+        if count:
+            self._own()
+            del self.timestamps[:count]
+            del self.readings[:count]
+        return count
+
+    def merge(self, timestamps, readings):
+        # merge a sorted batch (no repeated timestamps) in one pass, returns True/False per reading
+        if not len(timestamps):
+            return []
+        self._own()
+        old_ts, old_kwh = self.timestamps, self.readings
+
+        # whole batch is newer: just extend the columns
+        if not old_ts or timestamps[0] > old_ts[-1]:
+            old_ts.extend(timestamps)
+            old_kwh.extend(readings)
+            return [True] * len(timestamps)
+
+        # otherwise copy old runs between batch readings, the part before the batch stays as it is
+        i = bisect.bisect_left(old_ts, timestamps[0])
+        new_ts, new_kwh = old_ts[:i], old_kwh[:i]
+        accepted = []
+        for ts, kwh in zip(timestamps, readings):
+            j = bisect.bisect_left(old_ts, ts, i)
+            new_ts.extend(old_ts[i:j])
+            new_kwh.extend(old_kwh[i:j])
+            i = j
+            if i < len(old_ts) and old_ts[i] == ts:
+                accepted.append(False)
+                continue
+            new_ts.append(ts)
+            new_kwh.append(kwh)
+            accepted.append(True)
+        new_ts.extend(old_ts[i:])
+        new_kwh.extend(old_kwh[i:])
+        self.timestamps, self.readings = new_ts, new_kwh
+        return accepted
+
+    def latest(self):
+        if not self.timestamps:
+            return None
+        return self.timestamps[-1], self.readings[-1]
+
+    def bounds(self, start=None, end=None, include_end=True):
+        # index range of readings with start <= timestamp <= end (or < end)
+        lo = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        if end is None:
+            hi = len(self.timestamps)
+        elif include_end:
+            hi = bisect.bisect_right(self.timestamps, end)
+        else:
+            hi = bisect.bisect_left(self.timestamps, end)
+        return lo, max(lo, hi)
+
+    def slice(self, start=None, end=None, include_end=True):
+        lo, hi = self.bounds(start, end, include_end)
+        return self.timestamps[lo:hi], self.readings[lo:hi]
+
+
+class StripedLock:
+    """A fixed set of locks shared out by meter ID, a meter always gets the same one.
+
+    Writers of a meter and readers that need a consistent view of it hold its lock;
+    work on meters with different locks runs side by side.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, meter_id):
+        return self._locks[hash(meter_id) % len(self._locks)]
+
+    @contextmanager
+    def holding_all(self):
+        # every lock, always taken in the same order, for a point-in-time view of all meters
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
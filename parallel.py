@@ -0,0 +1,68 @@
+# Process-pool execution of per-meter work (json load, tier build, json save)
+#
+# meters are cut into batches that go to worker processes, results come back in the order the meters were
+# given. Columns travel as the raw bytes of their arrays (pack / unpack) and json as its text, never as
+# pickled dicts or lists of floats. Workers are started with "spawn" on every platform, the process
+# handing out work already runs threads (wal flusher, compactor) that must not be forked.
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from meter_store import MeterSeries
+
+
+BATCH_ITEMS = 64  # meters per task
+MIN_ITEMS = 2 * BATCH_ITEMS  # smaller jobs run in this process, starting workers costs more than they save
+
+
+def worker_count(workers=None):
+    # None: one per core
+    return max(1, os.cpu_count() or 1) if workers is None else max(1, workers)
+
+
+def pack(series):
+    return series.timestamps.tobytes(), series.readings.tobytes()
+
+
+def unpack(columns):
+    series = MeterSeries()
+    series.timestamps.frombytes(columns[0])
+    series.readings.frombytes(columns[1])
+    return series
+
+
+def _run_batch(function, batch):
+    return [(key, function(*args)) for key, args in batch]
+
+
+def map_meters(function, items, workers=1, batch_size=BATCH_ITEMS):
+    """Yields (key, function(*args)) for every (key, args) of items, in order.
+
+    function must be defined at module level and args picklable; items can be a generator, it is read
+    as batches are handed out and at most two batches per worker wait for their results.
+    """
+    workers = worker_count(workers)
+    items = iter(items)
+    head = list(islice(items, MIN_ITEMS))
+    if workers == 1 or len(head) < MIN_ITEMS:
+        for key, args in head:
+            yield key, function(*args)
+        for key, args in items:
+            yield key, function(*args)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    items = chain(head, items)
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pending = deque()
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+            pending.append(pool.submit(_run_batch, function, batch))
+            while len(pending) > 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,73 @@
+# Cache for user / government query results
+#
+# a result is stored under (scope, query_type, version of the scope), scope being ("meter", meterID) or
+# ("area", region, area). Every ingest bumps the version of the meter and its area, so a cached result is
+# never served after its data changed; old versions are simply never asked for again and age out.
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU cache with a size limit, a time-to-live and data versions."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def version(self, scope):
+        return self._versions.get(scope, 0)
+
+    def bump(self, *scopes):
+        # call after the data of these scopes has changed
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def get(self, scope, query_type):
+        # the cached result, None if it would have to be computed (the miss is counted when it is)
+        key = (scope, query_type, self.version(scope))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_or_compute(self, scope, query_type, compute):
+        key = (scope, query_type, self.version(scope))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        # computed outside the lock, two threads missing together may both compute, that is fine
+        result = compute()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations}
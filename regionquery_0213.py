@@ -11,6 +11,7 @@ import datetime
 import dash
 from dash import dcc, html, Input, Output, State, ctx
 import plotly.graph_objects as go
+from meter_store import get_reading_at
 
 with open("predataset.json", "r") as f:
     user_data = json.load(f)
@@ -51,10 +52,6 @@ app.layout = html.Div([
     dcc.Graph(id="usage-graph"),
 ])
 
-def get_reading_at(readings, target_time):
-    readings_sorted = sorted(readings, key=lambda x: abs(x["timestamp"] - target_time))
-    return readings_sorted[0]["reading_kwh"] if readings_sorted else None
-
 @app.callback(
     Output("area-dropdown", "options"),
     Input("region-dropdown", "value")
@@ -75,7 +72,8 @@ def query_data(n_clicks, region, area, query_type):
         return "Please select region, area, and time period.", go.Figure()
 
     meter_ids = [u["meterID"] for u in user_data if u["region"] == region and u["area"] == area]
-    readings = [r for m in meter_ids if m in meter_data for r in meter_data[m]]
+    # readings of several meters, sorted once so the closest-reading lookup can bisect
+    readings = sorted((r for m in meter_ids if m in meter_data for r in meter_data[m]), key=lambda r: r["timestamp"])
     
     if not readings:
         return "No data found for this selection.", go.Figure()
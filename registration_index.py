@@ -0,0 +1,51 @@
+# Hash lookups over the Registration.json records
+# the records themselves stay in registration_data (that list is what save_user writes), this only indexes them
+UNBOUND = "NA"
+
+
+class RegistrationIndex:
+    """userID -> record, meterID -> record and region -> area -> meterIDs."""
+
+    def __init__(self, registration_data):
+        self.records = registration_data
+        self.by_user = {}
+        self.by_meter = {}
+        self.areas = {}  # region -> {area: [meterID, ...]} in registration order
+        for record in registration_data:
+            self.by_meter.setdefault(record["meterID"], record)
+            if record["userID"] != UNBOUND:
+                self.by_user.setdefault(record["userID"], record)
+            self.areas.setdefault(record["region"], {}).setdefault(record["area"], []).append(record["meterID"])
+
+    def user(self, user_id):
+        return self.by_user.get(user_id)
+
+    def meter(self, meter_id):
+        return self.by_meter.get(meter_id)
+
+    def regions(self):
+        return sorted(self.areas)
+
+    def areas_in(self, region):
+        return sorted(self.areas.get(region, {}))
+
+    def meters_in(self, region, area):
+        return self.areas.get(region, {}).get(area, [])
+
+    def bind(self, meter_id, user_id):
+        # same rules as the registration page: meter must exist, userID must not belong to another meter
+        record = self.by_meter.get(meter_id)
+        if record is None:
+            return "Error: meterID not found."
+
+        # "NA" marks unbound meters, it is never a user (the old page refused it as already taken)
+        owner = self.by_user.get(user_id)
+        if user_id == UNBOUND or owner is not None and owner["meterID"] != meter_id:
+            return "Error: userID already exists, choose another."
+
+        old_user_id = record["userID"]
+        if self.by_user.get(old_user_id) is record:
+            del self.by_user[old_user_id]
+        record["userID"] = user_id
+        self.by_user[user_id] = record
+        return "Binding Successful!" if old_user_id == UNBOUND else "Update Successful!"
@@ -0,0 +1,280 @@
+# Tiered retention: raw readings for a recent window, older history as hourly / daily / monthly tiers
+#
+# a tier keeps the first and the last register reading of every bucket (hour, day, month). Registers are
+# cumulative, so the consumption of a bucket, and between any two bucket boundaries, is the difference of
+# two kept readings: exactly what the raw readings give, nothing is summed or estimated.
+# Every ingested reading is folded into the tiers straight away, so a tier is always complete up to the
+# newest reading; retention then only drops what a coarser level still holds:
+#   raw readings      older than raw_days     (cut at an hour,  the hourly tier holds them)
+#   hourly points     older than hourly_days  (cut at a day,    the daily tier holds them)
+#   daily points      older than daily_days   (cut at a month,  the monthly tier holds them)
+#   monthly points    kept, two per month
+# Cuts fall on boundaries of the coarser tier, so stitching a coarse tier (before) to a finer one (after)
+# keeps every bucket exact. The caller holds the meter's lock around fold / apply / view.
+import bisect
+import os
+import threading
+from datetime import datetime
+
+from meter_store import MeterSeries, from_epoch, latest_allowed, to_epoch
+from parallel import map_meters, pack, unpack
+from snapshot import load_snapshot, write_snapshot
+
+
+DAY = 86400
+
+
+class Tier:
+    """Fixed-width buckets of `width` seconds."""
+
+    def __init__(self, name, width):
+        self.name = name
+        self.width = width
+
+    def bucket(self, timestamp):
+        # (start, end) of the bucket holding timestamp, end excluded
+        start = timestamp - timestamp % self.width
+        return start, start + self.width
+
+
+class MonthTier(Tier):
+    """Calendar months, `width` is the longest one (used to compare resolutions)."""
+
+    def __init__(self, name, width):
+        super().__init__(name, width)
+        self._last = (0, 0)  # readings mostly arrive in the same month as the one before
+
+    def bucket(self, timestamp):
+        last = self._last
+        if last[0] <= timestamp < last[1]:
+            return last
+        day = from_epoch(timestamp)
+        start = datetime(day.year, day.month, 1)
+        end = datetime(day.year + day.month // 12, day.month % 12 + 1, 1)
+        self._last = (to_epoch(start), to_epoch(end))
+        return self._last
+
+
+HOURLY = Tier("hourly", 3600)
+DAILY = Tier("daily", DAY)
+MONTHLY = MonthTier("monthly", 31 * DAY)
+TIERS = (HOURLY, DAILY, MONTHLY)  # finest first
+
+
+def fold(points, tier, timestamp, reading_kwh):
+    # add one reading to a tier series, it only stays if it is the first or the last of its bucket
+    start, end = tier.bucket(timestamp)
+    timestamps = points.timestamps
+    if not timestamps or timestamp > timestamps[-1]:
+        # newest reading, the usual case: the new last point of the newest bucket, or a new bucket
+        if len(timestamps) > 1 and timestamps[-2] >= start:
+            points.replace(len(timestamps) - 1, timestamp, reading_kwh)
+        else:
+            points.append(timestamp, reading_kwh)
+        return
+    lo = bisect.bisect_left(timestamps, start)
+    hi = bisect.bisect_left(timestamps, end, lo)
+    if hi - lo < 2:
+        points.insert(timestamp, reading_kwh)  # refuses a timestamp it already has
+    elif timestamp < timestamps[lo]:
+        points.replace(lo, timestamp, reading_kwh)
+    elif timestamp > timestamps[hi - 1]:
+        points.replace(hi - 1, timestamp, reading_kwh)
+
+
+def build(series, tier, start=None):
+    # tier series of the readings start <= ts (all of them without start), one pass over sorted readings
+    points = MeterSeries()
+    timestamps, readings = series.slice(start)
+    end = None
+    for i, timestamp in enumerate(timestamps):
+        if end is None or timestamp >= end:
+            if i and points.timestamps[-1] != timestamps[i - 1]:
+                points.append(timestamps[i - 1], readings[i - 1])
+            end = tier.bucket(timestamp)[1]
+            points.append(timestamp, readings[i])
+    if len(timestamps) > 1 and points.timestamps[-1] != timestamps[-1]:
+        points.append(timestamps[-1], readings[-1])
+    return points
+
+
+def sync_tiers(series, kept):
+    # tiers of a meter in line with its raw series, from the tiers kept so far ({name: MeterSeries}):
+    # points of buckets the raw readings fully cover are rebuilt from them, older ones are kept
+    if not len(series):
+        return kept
+    first = series.timestamps[0]
+    tiers = {}
+    for tier in TIERS:
+        start, end = tier.bucket(first)
+        rebuilt = build(series, tier)
+        # the first bucket may also have older readings the raw series no longer has
+        for timestamp, reading_kwh in zip(*kept[tier.name].slice(start, end, include_end=False)):
+            fold(rebuilt, tier, timestamp, reading_kwh)
+        older = kept[tier.name].slice(None, start, include_end=False)
+        tiers[tier.name] = MeterSeries(older[0] + rebuilt.timestamps, older[1] + rebuilt.readings)
+    return tiers
+
+
+def _sync_packed(raw, kept):
+    # worker side of sync_tiers, columns in and out as bytes
+    tiers = sync_tiers(unpack(raw), {name: unpack(columns) for name, columns in kept.items()})
+    return {name: pack(points) for name, points in tiers.items()}
+
+
+class RetentionPolicy:
+    """How long each level keeps its data, in days counted back from a meter's newest reading."""
+
+    def __init__(self, raw_days=35, hourly_days=180, daily_days=3 * 365):
+        if not 1 <= raw_days <= hourly_days <= daily_days:
+            raise ValueError("Retention needs 1 <= raw_days <= hourly_days <= daily_days")
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+
+    def cuts(self, latest):
+        # (raw, hourly, daily) cut timestamps, each on a boundary of the next coarser tier
+        return (HOURLY.bucket(latest - self.raw_days * DAY)[0],
+                DAILY.bucket(latest - self.hourly_days * DAY)[0],
+                MONTHLY.bucket(latest - self.daily_days * DAY)[0])
+
+
+class TieredStore:
+    """Hourly / daily / monthly tiers of every meter, next to the raw series in meter_data."""
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetentionPolicy()
+        self.tiers = {}  # meterID -> {tier name: MeterSeries}
+        self.raw_from = {}  # meterID -> oldest timestamp raw data is still kept for
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _meter(self, meter_id):
+        tiers = self.tiers.get(meter_id)
+        if tiers is None:
+            tiers = self.tiers.setdefault(meter_id, {tier.name: MeterSeries() for tier in TIERS})
+        return tiers
+
+    def fold(self, meter_id, timestamp, reading_kwh):
+        for tier, points in zip(TIERS, self._meter(meter_id).values()):
+            fold(points, tier, timestamp, reading_kwh)
+
+    def too_old(self, meter_id, timestamp):
+        # raw data before the cut is gone, a reading there cannot be placed between its neighbours
+        return timestamp < self.raw_from.get(meter_id, timestamp)
+
+    def sync(self, meter_id, series):
+        # bring the tiers in line with the raw series (at start: tiers from their files, raw after wal replay)
+        self.tiers[meter_id] = sync_tiers(series, self._meter(meter_id))
+
+    def sync_all(self, meter_data, workers=1):
+        # sync() of every meter, spread over `workers` processes
+        packed = ((meter_id, (pack(series), {name: pack(points) for name, points in self._meter(meter_id).items()}))
+                  for meter_id, series in meter_data.items())
+        for meter_id, tiers in map_meters(_sync_packed, packed, workers):
+            self.tiers[meter_id] = {name: unpack(columns) for name, columns in tiers.items()}
+
+    def apply(self, meter_id, series):
+        # drop what has aged out of each level, returns how many readings / points went
+        if not len(series):
+            return 0
+        # counted back from the newest reading that is not in the future: one stored before such readings
+        # were refused (e.g. replayed from the wal) must not cut away the real history
+        newest = bisect.bisect_right(series.timestamps, latest_allowed()) - 1
+        if newest < 0:
+            return 0
+        raw_cut, hourly_cut, daily_cut = self.policy.cuts(series.timestamps[newest])
+        tiers = self._meter(meter_id)
+        self.raw_from[meter_id] = max(raw_cut, self.raw_from.get(meter_id, raw_cut))
+        return (series.drop_before(raw_cut) + tiers[HOURLY.name].drop_before(hourly_cut)
+                + tiers[DAILY.name].drop_before(daily_cut))
+
+    def view(self, meter_id, series, start=None, resolution=1):
+        # readings start <= ts of a meter for buckets of `resolution` seconds or coarser: the coarsest level
+        # that still resolves them, older parts it no longer has from the coarser tiers. A bucket cut by
+        # start comes from the finest data, so its first reading is the first one at or after start
+        tiers = self.tiers.get(meter_id)
+        if tiers is None:
+            return series
+        levels = [series] + [tiers[tier.name] for tier in TIERS]
+        chosen = max([0] + [i + 1 for i, tier in enumerate(TIERS) if tier.width <= resolution])
+        if chosen and start is not None:
+            bucket_start, bucket_end = TIERS[chosen - 1].bucket(start)
+            if bucket_start != start:
+                head = self.view(meter_id, series, start).slice(start, bucket_end, include_end=False)
+                tail = self.view(meter_id, series, bucket_end, resolution)
+                return MeterSeries(head[0] + tail.timestamps, head[1] + tail.readings)
+
+        timestamps, readings = levels[chosen].slice(start)
+        boundary = levels[chosen].timestamps[0] if len(levels[chosen]) else None
+        for points in levels[chosen + 1:]:
+            if boundary is not None and start is not None and boundary <= start:
+                break
+            older = points.slice(start, boundary, include_end=False)
+            timestamps, readings = older[0] + timestamps, older[1] + readings
+            if len(points) and (boundary is None or points.timestamps[0] < boundary):
+                boundary = points.timestamps[0]
+        return MeterSeries(timestamps, readings)
+
+    def frozen(self):
+        # {tier name: {meterID: read-only view}} of the tiers as they are now, copy on write as
+        # MeterSeries.frozen; the caller holds every meter's lock
+        return {tier.name: {meter_id: tiers[tier.name].frozen() for meter_id, tiers in self.tiers.items()}
+                for tier in TIERS}
+
+    def release(self, views, locks):
+        # the views of frozen() are not used any more
+        for name, meters in views.items():
+            for meter_id, view in meters.items():
+                with locks(meter_id):
+                    tiers = self.tiers.get(meter_id)
+                    if tiers is not None:
+                        tiers[name].release(view)
+
+    def counts(self):
+        # points held per tier, over all meters
+        return {tier.name: sum(len(tiers[tier.name]) for tiers in list(self.tiers.values())) for tier in TIERS}
+
+    def copy_tier(self, name, locks):
+        # {meterID: copy of one tier}, every meter copied under its lock
+        copies = {}
+        for meter_id, tiers in list(self.tiers.items()):
+            with locks(meter_id):
+                copies[meter_id] = tiers[name].copy()
+        return copies
+
+    @staticmethod
+    def tier_path(snapshot_path, name):
+        # meter_data.snap -> meter_data.hourly.snap, ...
+        return f"{os.path.splitext(snapshot_path)[0]}.{name}.snap"
+
+    def save(self, snapshot_path, locks):
+        # written next to the raw snapshot; these files are the only copy of history older than the raw
+        # retention window, meter_data.json no longer has it once retention has run
+        for tier in TIERS:
+            write_snapshot(self.copy_tier(tier.name, locks), self.tier_path(snapshot_path, tier.name))
+
+    def load(self, snapshot_path):
+        for tier in TIERS:
+            path = self.tier_path(snapshot_path, tier.name)
+            if os.path.exists(path):
+                for meter_id, points in load_snapshot(path).items():
+                    self._meter(meter_id)[tier.name] = points
+
+    def start(self, interval, apply):
+        # apply() every `interval` seconds on a background thread
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    apply()
+                except Exception as e:
+                    print(f"Retention failed: {e}")
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
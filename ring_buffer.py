@@ -0,0 +1,38 @@
+# Fixed-size buffer of the latest ingested readings, for the meter reading page
+# every item gets a sequence number (1, 2, 3, ...), a reader keeps the last number it has seen
+# and asks for what came after it; memory and the cost of one read do not grow with uptime
+import threading
+
+
+class RingBuffer:
+    """Keeps the newest `capacity` items, numbered in order of arrival."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._last_seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        # sequence number of the newest item, 0 while empty
+        return self._last_seq
+
+    def __len__(self):
+        return min(self._last_seq, self.capacity)
+
+    def append(self, item):
+        with self._lock:
+            self._last_seq += 1
+            self._items[self._last_seq % self.capacity] = item
+            return self._last_seq
+
+    def since(self, seq, limit=None):
+        # (items after sequence number seq, oldest first, last_seq); items already overwritten are skipped,
+        # with a limit only the newest `limit` of them are returned
+        with self._lock:
+            last = self._last_seq
+            first = max(seq + 1, last - self.capacity + 1, 1)
+            if limit is not None:
+                first = max(first, last - limit + 1)
+            return [self._items[s % self.capacity] for s in range(first, last + 1)], last
@@ -0,0 +1,101 @@
+# Binary snapshot of meter_data, opened with mmap so a meter is only read when it is used
+#
+# layout (header and index little endian, columns in the byte order named in the header):
+#   header : magic(8) version(u16) byteorder(1) pad(1) meter_count(u32)
+#   index  : per meter -> id_length(u16) count(u64) ts_offset(u64) kwh_offset(u64) id(utf-8)
+#   data   : per meter -> count x int64 epoch seconds, then count x float64 kWh (8-byte aligned)
+# convert: python snapshot.py to-snapshot meter_data.json meter_data.snap
+#          python snapshot.py to-json meter_data.snap meter_data.json
+import mmap
+import os
+import struct
+import sys
+
+from meter_store import MeterSeries
+from meter_json import load_meter_json, write_meter_json
+
+
+MAGIC = b"METERSNP"
+VERSION = 1
+HEADER = struct.Struct("<8sHcxI")
+INDEX_ENTRY = struct.Struct("<HQQQ")
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot(meter_data, path):
+    # write to a temp file first, readers of the old snapshot keep their mmap
+    meters = [(meter_id.encode("utf-8"), series) for meter_id, series in meter_data.items()]
+
+    offset = _align(HEADER.size + sum(INDEX_ENTRY.size + len(key) for key, _ in meters))
+    index = []
+    for key, series in meters:
+        count = len(series)
+        index.append((key, count, offset, offset + count * 8))
+        offset += count * 16
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode(), len(meters)))
+        for key, count, ts_offset, kwh_offset in index:
+            f.write(INDEX_ENTRY.pack(len(key), count, ts_offset, kwh_offset))
+            f.write(key)
+        for (key, series), (_, _, ts_offset, _) in zip(meters, index):
+            f.write(b"\0" * (ts_offset - f.tell()))
+            f.write(series.timestamps.tobytes())
+            f.write(series.readings.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    # only the header and index are parsed here, the columns are paged in by MeterSeries on first use
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Empty snapshot file: {path}")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, byteorder, meter_count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a meter snapshot (version {VERSION}): {path}")
+    swap = byteorder != sys.byteorder[0].encode()
+
+    meter_data = {}
+    position = HEADER.size
+    for _ in range(meter_count):
+        key_length, count, ts_offset, kwh_offset = INDEX_ENTRY.unpack_from(buffer, position)
+        position += INDEX_ENTRY.size
+        meter_id = buffer[position:position + key_length].decode("utf-8")
+        position += key_length
+        meter_data[meter_id] = MeterSeries.from_buffer(buffer, ts_offset, kwh_offset, count, swap)
+    return meter_data
+
+
+def snapshot_is_current(snapshot_path, json_path):
+    # snapshot can be used instead of the json file when it was written after it
+    if not os.path.exists(snapshot_path):
+        return False
+    if not os.path.exists(json_path):
+        return True
+    return os.path.getmtime(snapshot_path) >= os.path.getmtime(json_path)
+
+
+def json_to_snapshot(json_path, snapshot_path):
+    write_snapshot(load_meter_json(json_path), snapshot_path)
+
+
+def snapshot_to_json(snapshot_path, json_path):
+    write_meter_json(load_snapshot(snapshot_path), json_path, indent=4)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-snapshot", "to-json"):
+        print("usage: python snapshot.py to-snapshot|to-json <source> <target>")
+        sys.exit(1)
+    if sys.argv[1] == "to-snapshot":
+        json_to_snapshot(sys.argv[2], sys.argv[3])
+    else:
+        snapshot_to_json(sys.argv[2], sys.argv[3])
@@ -0,0 +1,85 @@
+# Periodic point-in-time snapshots of meter and registration data, written in the background
+#
+# snapshots/<YYYYmmddTHHMMSS>/meter_data.snap          binary meter snapshot (see snapshot.py)
+#                            /meter_data.hourly.snap   retention tiers (retention.py), the only copy of
+#                            /meter_data.daily.snap    history older than the raw retention window
+#                            /meter_data.monthly.snap
+#                            /Registration.json
+# the newest `retention` snapshots are kept. To go back to one, copy all its files next to the app
+# (python snapshot.py to-json ... gives meter_data.json from meter_data.snap) and restart.
+#
+# capture() is called on the scheduler thread and must return ({file name: meter views}, registration
+# copy, release) for one moment in time; the views are written afterwards while ingestion and queries
+# carry on, release() is called once the files are on disk.
+import json
+import os
+import shutil
+import threading
+import time
+
+from meter_json import atomic_open
+from snapshot import write_snapshot
+
+
+class SnapshotScheduler:
+    """Writes a snapshot every `interval` seconds and keeps the newest `retention` of them."""
+
+    def __init__(self, directory, capture, interval=600, retention=6):
+        self.directory = directory
+        self.capture = capture
+        self.interval = interval
+        self.retention = retention
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def snapshots(self):
+        # finished snapshots, oldest first
+        return sorted(name for name in os.listdir(self.directory)
+                      if not name.endswith(".tmp") and os.path.isdir(os.path.join(self.directory, name)))
+
+    def snapshot_now(self):
+        meter_files, registration, release = self.capture()
+        try:
+            name = time.strftime("%Y%m%dT%H%M%S")
+            same_second = [other for other in self.snapshots() if other.startswith(name)]
+            if same_second:
+                # more than one in a second: numbered after the newest, so names still sort by age
+                number = max(int(other.partition("-")[2] or 0) for other in same_second) + 1
+                name = f"{name}-{number:03d}"
+            path = os.path.join(self.directory, name)
+
+            # the folder only gets its final name when all files are complete
+            tmp_path = path + ".tmp"
+            os.makedirs(tmp_path, exist_ok=True)
+            for file_name, meter_views in meter_files.items():
+                write_snapshot(meter_views, os.path.join(tmp_path, file_name))
+            with atomic_open(os.path.join(tmp_path, "Registration.json")) as f:
+                json.dump(registration, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, path)
+        finally:
+            release()
+
+        self._prune()
+        return path
+
+    def _prune(self):
+        for name in self.snapshots()[:-self.retention]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def start(self):
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.snapshot_now()
+                except OSError as e:
+                    print(f"Snapshot failed: {e}")
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -11,6 +11,7 @@ import datetime
 import dash
 from dash import dcc, html, Input, Output, State, ctx
 import plotly.graph_objects as go
+from meter_store import get_reading_at
 
 # Load user and meter data
 with open("predataset.json", "r") as f:
@@ -55,11 +56,6 @@ app.layout = html.Div([
     ], id="query-section", style={"display": "none"}),
 ])
 
-# Helper function to find closest timestamp reading
-def get_reading_at(readings, target_time):
-    readings_sorted = sorted(readings, key=lambda x: abs(x["timestamp"] - target_time))
-    return readings_sorted[0]["reading_kwh"] if readings_sorted else None
-
 # Handle login and queries
 @app.callback(
     [Output("login-status", "children"), 
@@ -119,9 +115,10 @@ def handle_callbacks(login_clicks, query_clicks, user_id, query_type):
         if not filtered_readings:
             return ("⚠️ No Data Available", {"display": "block"}, "No electricity data found for this period.", go.Figure())
 
-        # Calculate electricity usage
-        results["usage"] = get_reading_at(filtered_readings, max(r["timestamp"] for r in filtered_readings)) - \
-                           get_reading_at(filtered_readings, min(r["timestamp"] for r in filtered_readings))
+        # Calculate electricity usage (the file is not guaranteed to be in time order, the lookup needs it)
+        ordered = sorted(filtered_readings, key=lambda r: r["timestamp"])
+        results["usage"] = get_reading_at(ordered, ordered[-1]["timestamp"]) - \
+                           get_reading_at(ordered, ordered[0]["timestamp"])
 
         # Create graph
         timestamps = [r["timestamp"] for r in filtered_readings]
@@ -0,0 +1,188 @@
+# Append-only write-ahead log for meter readings
+#
+# every accepted reading is appended to the current segment file (wal/000001.wal, ...)
+# record: crc32(u32) id_length(u16) meter_id(utf-8) timestamp(int64) reading_kwh(float64), little endian
+# one flusher thread writes and fsyncs whatever is pending, so many writers share one fsync (group commit)
+# one process owns a log directory at a time (wal/LOCK), a second one would replay a stale copy and its
+# checkpoints would delete the segments of the first
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+RECORD_HEADER = struct.Struct("<IH")
+RECORD_BODY = struct.Struct("<qd")
+SEGMENT_SUFFIX = ".wal"
+LOCK_NAME = "LOCK"
+
+
+def encode_record(meter_id, timestamp, reading_kwh):
+    payload = meter_id.encode("utf-8") + RECORD_BODY.pack(timestamp, reading_kwh)
+    return RECORD_HEADER.pack(zlib.crc32(payload), len(payload) - RECORD_BODY.size) + payload
+
+
+def read_segment(path):
+    # yields (meter_id, timestamp, reading_kwh), stops at a torn or corrupt tail
+    with open(path, 'rb') as f:
+        data = f.read()
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        crc, key_length = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        end = start + key_length + RECORD_BODY.size
+        payload = data[start:end]
+        if len(payload) < key_length + RECORD_BODY.size or zlib.crc32(payload) != crc:
+            print(f"WAL: ignoring damaged tail of {path} at byte {position}")
+            return
+        timestamp, reading_kwh = RECORD_BODY.unpack_from(payload, key_length)
+        yield payload[:key_length].decode("utf-8"), timestamp, reading_kwh
+        position = end
+
+
+def lock_directory(directory):
+    # open lock file held exclusively until it is closed, RuntimeError if another process holds it
+    lock_file = open(os.path.join(directory, LOCK_NAME), 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(f"write-ahead log {directory} is in use by another process")
+    return lock_file
+
+
+class WriteAheadLog:
+    """Segmented append-only log with batched fsync."""
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = lock_directory(directory)
+        self.directory = directory
+        self.segment_size = segment_size
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._flushed = 0
+        self._closed = False
+
+        # _io_lock guards the open segment file, _checkpoint_lock keeps checkpoints one at a time
+        self._io_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        numbers = self.segment_numbers()
+        self._segment_number = (numbers[-1] if numbers else 0) + 1
+        self._file = open(self._segment_path(self._segment_number), 'ab')
+
+        self._compactor_stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{number:06d}{SEGMENT_SUFFIX}")
+
+    def segment_numbers(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def replay(self):
+        # every record in every segment, oldest first
+        for number in self.segment_numbers():
+            yield from read_segment(self._segment_path(number))
+
+    def append(self, meter_id, timestamp, reading_kwh, wait=True):
+        # wait=True returns only after the record is on disk
+        return self.append_many([(meter_id, timestamp, reading_kwh)], wait)
+
+    def append_many(self, records, wait=True):
+        # a whole batch of (meter_id, timestamp, reading_kwh) goes into the log as one write
+        data = b"".join(encode_record(*record) for record in records)
+        with self._cond:
+            if self._closed:
+                raise ValueError("write-ahead log is closed")
+            self._pending.append(data)
+            self._appended += 1
+            sequence = self._appended
+            self._cond.notify_all()
+            while wait and self._flushed < sequence:
+                self._cond.wait()
+        return sequence
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = b"".join(self._pending)
+                self._pending = []
+                sequence = self._appended
+
+            # records arriving during the fsync wait for the next batch
+            with self._io_lock:
+                self._file.write(batch)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                if self._file.tell() >= self.segment_size:
+                    self._rotate()
+
+            with self._cond:
+                self._flushed = sequence
+                self._cond.notify_all()
+
+    def _rotate(self):
+        # caller holds _io_lock
+        self._file.close()
+        self._segment_number += 1
+        self._file = open(self._segment_path(self._segment_number), 'ab')
+        return self._segment_number - 1
+
+    def has_records(self):
+        with self._io_lock:
+            if self._file.tell() > 0:
+                return True
+        return len(self.segment_numbers()) > 1
+
+    def checkpoint(self, write_snapshot):
+        # write_snapshot() must save everything appended so far, the older segments are dropped after it
+        with self._checkpoint_lock:
+            with self._io_lock:
+                last = self._rotate()
+            write_snapshot()
+            for number in self.segment_numbers():
+                if number <= last:
+                    os.remove(self._segment_path(number))
+
+    def start_compactor(self, interval, write_snapshot):
+        # background thread folding the log into the snapshot every `interval` seconds
+        def compact():
+            while not self._compactor_stop.wait(interval):
+                try:
+                    if self.has_records():
+                        self.checkpoint(write_snapshot)
+                except Exception as e:
+                    # segments are kept until a checkpoint succeeds, the next round tries again
+                    print(f"WAL compaction failed: {e}")
+
+        thread = threading.Thread(target=compact, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self._compactor_stop.set()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        with self._io_lock:
+            self._file.close()
+        self._lock_file.close()